@@ -1,43 +1,130 @@
-import json
 import time
-from flask import Flask, request, jsonify
-import requests
+import click
+from flask import Flask, g, request, jsonify
 import os
+import threading
 from dotenv import load_dotenv
 from flask_cors import CORS
 import logging
-import firebase_admin
-from firebase_admin import credentials, firestore
-import base64
+import firebase_db
+import metrics
+from log_config import configure_logging, log_payload, log_request
+from cashfree_client import CashfreeClient
+from circuit_breaker import UpstreamUnavailable
+from idempotency import Idempotent
+from order_cache import OrderStatusCache, shared_cache_from_env
+from order_index import get_order_record, migrate_user_orders
+from order_writer import OrderStatusWriter
+from reconcile import ReconcileJob, Reconciler, acquire_lock
+from webhook_filter import WebhookIntake
+from webhook_queue import WebhookQueue, WebhookWorkerPool, parse_webhook, status_update_handler
 
-# Read and decode the Firebase key
-firebase_key_base64 = os.getenv('FIREBASE_KEY_BASE64')
-if firebase_key_base64:
-    firebase_key_json = base64.b64decode(firebase_key_base64).decode('utf-8')
-    cred = credentials.Certificate(json.loads(firebase_key_json))
-    firebase_admin.initialize_app(cred)
-else:
-    raise ValueError("FIREBASE_KEY_BASE64 environment variable is not set")
+load_dotenv()
 
-db = firestore.client()
+# JSON logs through a background listener; levels and sampling come from LOG_* env vars
+configure_logging()
 
-load_dotenv()
+# Firebase is initialised on first use so the worker can start serving
+# before grpc and google-cloud are imported. FIREBASE_INIT picks when:
+# 'background' (default) warms it on a thread right away, 'lazy' waits for
+# the first Firestore call and 'eager' does it here at import time.
+FIREBASE_INIT = os.getenv('FIREBASE_INIT', 'background')
+db = firebase_db.LazyClient()
+if FIREBASE_INIT == 'eager':
+    firebase_db.get_db()
+elif FIREBASE_INIT == 'background':
+    firebase_db.warm_up()
 
-logging.basicConfig(level=logging.DEBUG)
+# Batches payment status updates into read-free Firestore commits
+status_writer = OrderStatusWriter.from_env(db)
 
 app = Flask(__name__)
 CORS(app)
 
-CASHFREE_APP_ID = os.getenv('CASHFREE_APP_ID')
-CASHFREE_SECRET_KEY = os.getenv('CASHFREE_SECRET_KEY')
-CASHFREE_API_URL = "https://api.cashfree.com/pg/orders"
-# CASHFREE_API_URL = "https://sandbox.cashfree.com/pg/orders"
+# One pooled Cashfree client per worker process; credentials, API URL,
+# timeouts and pool size come from the environment.
+cashfree = CashfreeClient.from_env()
+
+# Set ORDER_CACHE_PATH to share cached entries between the workers on a host
+shared_cache = shared_cache_from_env()
+
+# Cashfree order state for /payment_response, kept fresh by webhook events
+order_cache = OrderStatusCache.from_env(cashfree.get_order, shared=shared_cache)
+
+# Duplicate /create_order and /resume_payment calls for an order share one result
+idempotent = Idempotent.from_env(shared=shared_cache)
+
+
+def existing_payment_session(order_id, customer_email):
+    """Returns the payment session of an open Cashfree order owned by customer_email, if any."""
+    check_response = cashfree.get_order(order_id)
+    if check_response.status_code == 200:
+        check_data = check_response.json()
+        owner = (check_data.get('customer_details') or {}).get('customer_email')
+        if check_data.get('order_status') == 'ACTIVE' and owner == customer_email:
+            return check_data.get('payment_session_id')
+    return None
+
+
+def request_order_id():
+    if request.args.get('order_id'):
+        return request.args['order_id']
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data.get('order_id') or parse_webhook(data)[0]
+    return None
+
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    metrics.start_request()
+
+
+@app.after_request
+def log_access(response):
+    if 'started' in g:
+        # Timing and logging must never change the response
+        try:
+            # Unknown paths share one label so scanners can't add series
+            route = request.endpoint or 'unmatched'
+            queued = metrics.queue_time(request.headers.get('X-Request-Start'))
+            response.headers['Server-Timing'] = metrics.finish_request(
+                route, response.status_code, time.perf_counter() - g.started, queued)
+            log_request(app.logger, route, response.status_code, g.started, order_id=request_order_id())
+        except Exception as e:
+            app.logger.error(f"Error recording request: {e}")
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 
 @app.route('/')
 def home():
     return "Application is running", 200
 
+
+@app.route('/ready')
+def ready():
+    if firebase_db.is_ready():
+        return jsonify({'status': 'ready'}), 200
+    # Kick off initialisation (a no-op if it is already running) and report back
+    firebase_db.warm_up()
+    return jsonify({'status': 'starting', 'error': firebase_db.warm_up_error()}), 503
+
+
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    # Raised before Cashfree is called, so the client can safely retry
+    app.logger.warning(f"Rejected Cashfree call: {e}")
+    return (jsonify({'error': 'Payment provider unavailable, please retry', 'retry_after': e.retry_after}),
+            503, {'Retry-After': str(e.retry_after)})
+
 @app.route('/create_order', methods=['POST'])
+@idempotent
 def create_order():
     try:
         data = request.json
@@ -51,13 +138,6 @@ def create_order():
         # return_url = f'https://teerkhelo.web.app/payment_response?order_id={order_id}'
         notify_url = 'https://cf-py-bvfc.onrender.com/webhook'
 
-        headers = {
-            'Content-Type': 'application/json',
-            'x-client-id': CASHFREE_APP_ID,
-            'x-client-secret': CASHFREE_SECRET_KEY,
-            'x-api-version': '2023-08-01'
-        }
-
         payload = {
             'order_id': order_id,
             'order_amount': data.get('order_amount'),
@@ -74,28 +154,43 @@ def create_order():
             }
         }
 
-        response = requests.post(CASHFREE_API_URL, json=payload, headers=headers)
+        response = cashfree.create_order(payload)
         response_data = response.json()
-        app.logger.debug(f"Cashfree response data: {response_data}")
+        log_payload(app.logger, 'create_order', "Cashfree response data", response_data,
+                    order_id=order_id, status=response.status_code)
 
         if response.status_code == 200:
             payment_session_id = response_data.get('payment_session_id', '')
 
             # Save order and payment session id to Firestore using email
             order_ref = db.collection('orders').document(order_id)
-            order_ref.set({
-                'order_amount': data.get('order_amount'),
-                'payment_session_id': payment_session_id,
-                'customer_email': user_email
-            })
+            with metrics.span('firestore', 'set_order'):
+                order_ref.set({
+                    'order_amount': data.get('order_amount'),
+                    'payment_session_id': payment_session_id,
+                    'payment_status': 'pending',
+                    'original_order_id': None,
+                    'customer_email': user_email,
+                    'customer_name': data.get('customer_name')
+                })
 
             return jsonify({
                 'order_id': order_id,
                 'payment_session_id': payment_session_id
             })
-        else:
-            return jsonify({'error': response_data.get('message', 'Unknown error occurred')}), response.status_code
+        elif response.status_code == 409:
+            # A duplicate request (possibly on another worker) already created
+            # this order; hand back its session instead of failing
+            payment_session_id = existing_payment_session(order_id, user_email)
+            if payment_session_id:
+                return jsonify({
+                    'order_id': order_id,
+                    'payment_session_id': payment_session_id
+                })
+        return jsonify({'error': response_data.get('message', 'Unknown error occurred')}), response.status_code
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
 
@@ -106,6 +201,7 @@ def create_order():
 
 # RESUME PAYMENT
 @app.route('/resume_payment', methods=['POST'])
+@idempotent
 def resume_payment():
     try:
         app.logger.debug("Resume payment started")
@@ -120,105 +216,102 @@ def resume_payment():
         # return_url = f'http://localhost:9538/payment_response?order_id={order_id}'
         notify_url = 'https://cf-py-bvfc.onrender.com/webhook'
 
-        headers = {
-            'Content-Type': 'application/json',
-            'x-client-id': CASHFREE_APP_ID,
-            'x-client-secret': CASHFREE_SECRET_KEY,
-            'x-api-version': '2023-08-01'
-        }
-
         # Check if order exists in Firestore
         app.logger.debug("Checking if order exists in Firestore")
-        user_ref = db.collection('users').document(user_email)
-        user_doc = user_ref.get()
-
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            orders = user_data.get('orders', {})
-            if order_id in orders:
-                app.logger.info(f"Order {order_id} found in Firestore.")
-                order_details = orders[order_id]
-                stored_payment_session_id = order_details.get('payment_session_id')
-
-                if stored_payment_session_id:
-                    app.logger.info(f"Using stored payment session ID for order {order_id}")
-                    return jsonify({
-                        'order_id': order_id,
-                        'payment_session_id': stored_payment_session_id
-                    })
-
-                # If no stored payment session ID, check with Cashfree
-                check_order_url = f'{CASHFREE_API_URL}/{order_id}'
-                check_response = requests.get(check_order_url, headers=headers)
-
-                if check_response.status_code == 200:
-                    check_data = check_response.json()
-                    if check_data.get('order_status') in ['PAID', 'EXPIRED']:
-                        # Create a new order with a new ID
-                        new_order_id = f"{order_id}_retry_{int(time.time())}"
-                    else:
-                        # Use existing order ID and payment session
-                        return jsonify({
-                            'order_id': order_id,
-                            'payment_session_id': check_data.get('payment_session_id')
-                        })
-                else:
-                    app.logger.info(f"Order {order_id} not found in Cashfree. Creating new payment session.")
-                    new_order_id = order_id  # Use the existing order ID
-
-                # Create a new payment session
-                payload = {
-                    'order_id': new_order_id,
-                    'order_amount': order_details.get('order_amount'),
-                    'order_currency': 'INR',
-                    'customer_details': {
-                        'customer_id': f'customer_{new_order_id}',
-                        'customer_name': user_data.get('name', 'Customer'),
-                        'customer_email': user_data.get('customer_email'),
-                        # 'customer_email': customer_email
-                    },
-                    'order_meta': {
-                        'return_url': return_url,
-                        'notify_url': notify_url
-                    }
-                }
-
-                response = requests.post(CASHFREE_API_URL, json=payload, headers=headers)
-                response_data = response.json()
-
-                app.logger.debug(f"Cashfree response: Status code: {response.status_code}, Data: {response_data}")
-
-                if response.status_code == 200:
-                    payment_session_id = response_data.get('payment_session_id', '')
-                    
-                    # Update Firestore with new order details
-                    user_ref.update({
-                        f'orders.{new_order_id}': {
-                            'order_amount': order_details.get('order_amount'),
-                            'payment_session_id': payment_session_id,
-                            'payment_status': 'pending',
-                            'original_order_id': order_id if new_order_id != order_id else None
-                        }
-                    })
-
-                    # Update separate 'orders' collection
-                    db.collection('orders').document(new_order_id).set({
-                        'order_amount': order_details.get('order_amount'),
-                        'payment_session_id': payment_session_id
-                    }, merge=True)
-
-                    return jsonify({
-                        'order_id': new_order_id,
-                        'payment_session_id': payment_session_id
-                    })
-                else:
-                    return jsonify({'error': response_data.get('message', 'Unknown error occurred')}), response.status_code
+        with metrics.span('firestore', 'get_order'):
+            order_details = get_order_record(db, order_id, user_email)
+
+        if order_details is None:
+            return jsonify({'error': 'Order ID not found in user orders'}), 404
+
+        app.logger.info("Order %s found in Firestore.", order_id, extra={'order_id': order_id})
+        stored_payment_session_id = order_details.get('payment_session_id')
 
+        if stored_payment_session_id:
+            app.logger.info("Using stored payment session ID for order %s", order_id, extra={'order_id': order_id})
+            return jsonify({
+                'order_id': order_id,
+                'payment_session_id': stored_payment_session_id
+            })
+
+        # If no stored payment session ID, check with Cashfree
+        check_response = cashfree.get_order(order_id)
+
+        if check_response.status_code == 200:
+            check_data = check_response.json()
+            if check_data.get('order_status') in ['PAID', 'EXPIRED']:
+                # Create a new order with a new ID
+                new_order_id = f"{order_id}_retry_{int(time.time())}"
             else:
-                return jsonify({'error': 'Order ID not found in user orders'}), 404
+                # Use existing order ID and payment session
+                return jsonify({
+                    'order_id': order_id,
+                    'payment_session_id': check_data.get('payment_session_id')
+                })
         else:
-            return jsonify({'error': 'User not found'}), 404
+            app.logger.info("Order %s not found in Cashfree. Creating new payment session.", order_id,
+                            extra={'order_id': order_id})
+            new_order_id = order_id  # Use the existing order ID
+
+        # Create a new payment session
+        payload = {
+            'order_id': new_order_id,
+            'order_amount': order_details.get('order_amount'),
+            'order_currency': 'INR',
+            'customer_details': {
+                'customer_id': f'customer_{new_order_id}',
+                'customer_name': order_details.get('customer_name') or 'Customer',
+                'customer_email': user_email,
+            },
+            'order_meta': {
+                'return_url': return_url,
+                'notify_url': notify_url
+            }
+        }
 
+        response = cashfree.create_order(payload)
+        response_data = response.json()
+
+        log_payload(app.logger, 'resume_payment', "Cashfree response", response_data,
+                    order_id=new_order_id, status=response.status_code)
+
+        if response.status_code == 200:
+            payment_session_id = response_data.get('payment_session_id', '')
+            new_order = {
+                'order_amount': order_details.get('order_amount'),
+                'payment_session_id': payment_session_id,
+                'payment_status': 'pending',
+                'original_order_id': order_id if new_order_id != order_id else None
+            }
+
+            # Update the order index and the user's orders map in one commit
+            batch = db.batch()
+            batch.set(db.collection('orders').document(new_order_id), {
+                **new_order,
+                'customer_email': user_email,
+                'customer_name': order_details.get('customer_name'),
+            }, merge=True)
+            batch.set(db.collection('users').document(user_email), {
+                'orders': {new_order_id: new_order}
+            }, merge=True)
+            with metrics.span('firestore', 'commit_order'):
+                batch.commit()
+
+            return jsonify({
+                'order_id': new_order_id,
+                'payment_session_id': payment_session_id
+            })
+        elif response.status_code == 409:
+            payment_session_id = existing_payment_session(new_order_id, user_email)
+            if payment_session_id:
+                return jsonify({
+                    'order_id': new_order_id,
+                    'payment_session_id': payment_session_id
+                })
+        return jsonify({'error': response_data.get('message', 'Unknown error occurred')}), response.status_code
+
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         app.logger.error(f"An error occurred: {str(e)}")
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
@@ -235,7 +328,7 @@ def update_databases_with_new_order(old_order_id, new_order_id, payment_session_
         })
 
         # Update Firestore
-        user_ref = firestore.client().collection('users').document(customer_phone)
+        user_ref = db.collection('users').document(customer_phone)
         user_ref.update({
             f'orders.{new_order_id}': {
                 'order_id': new_order_id,
@@ -259,18 +352,19 @@ def payment_response():
     order_id = data.get('order_id')
 
     # Verify the payment with Cashfree
-    payment_verification_url = f'https://api.cashfree.com/pg/orders/{order_id}'
-    headers = {
-        'x-client-id': CASHFREE_APP_ID,
-        'x-client-secret': CASHFREE_SECRET_KEY,
-    }
-
-    verification_response = requests.get(payment_verification_url, headers=headers)
-    verification_data = verification_response.json()
+    try:
+        with metrics.span('cache', 'order_status'):
+            verification_status, verification_data = order_cache.get(order_id)
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error verifying payment for order {order_id}: {str(e)}")
+        return jsonify({'error': 'Payment verification unavailable', 'order_id': order_id}), 502
 
-    if verification_response.status_code == 200 and verification_data.get('order_status') == 'PAID':
+    if verification_status == 200 and verification_data.get('order_status') == 'PAID':
         # Payment is verified, update order status
-        update_order_status(order_id, 'Order Completed', verification_data.get('customer_email'))
+        customer_email = (verification_data.get('customer_details') or {}).get('customer_email')
+        update_order_status(order_id, 'Order Completed', customer_email or verification_data.get('customer_email'))
         return jsonify({
             'message': 'Payment verified',
             'order_id': order_id,
@@ -284,56 +378,90 @@ def payment_response():
         })
 
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    try:
-        data = request.json
-        logging.debug(f"Received webhook data: {data}")
+# Webhook payloads go to a durable on-disk queue and are applied to
+# Firestore by background workers
+webhook_queue = WebhookQueue.from_env()
+webhook_workers = WebhookWorkerPool.from_env(webhook_queue, status_update_handler(status_writer))
 
-        order_id = data.get('data', {}).get('order', {}).get('order_id')
-        payment_status = data.get('data', {}).get('payment', {}).get('payment_status')
-        customer_email = data.get('data', {}).get('customer_details', {}).get('customer_email')
+# Signature checks and the seen-set that keep retries and repeat events
+# away from Firestore
+webhook_intake = WebhookIntake.from_env(webhook_queue, order_cache, shared=shared_cache,
+                                        on_queued=webhook_workers.notify)
 
-        if not order_id or not payment_status or not customer_email:
-            logging.error("Required data is missing in the webhook.")
-            return jsonify({'status': 'error', 'message': 'Invalid data received'}), 400
-
-        # Update the payment status
-        if payment_status == 'SUCCESS':
-            update_order_status(order_id, 'Order Completed', customer_email)
-        else:
-            update_order_status(order_id, payment_status.capitalize(), customer_email)
 
-        return jsonify({'status': 'success'}), 200
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    try:
+        body, status = webhook_intake.handle(request.get_data(), request.headers)
+        return jsonify(body), status
 
     except Exception as e:
         logging.error(f"Error processing webhook: {e}")
         return jsonify({'error': 'Internal server error'}), 500
-    
+
+
+@app.route('/webhook/queue', methods=['GET'])
+def webhook_queue_depth():
+    return jsonify(webhook_queue.depth()), 200
 
 
 def update_order_status(order_id, status, customer_email):
+    """Returns False only when the update failed and is worth retrying."""
     try:
-        # Access the specific user document based on the email
-        user_ref = db.collection('users').document(customer_email)
-        user_doc = user_ref.get()
-
-        if user_doc.exists:
-            # Get the orders subcollection
-            orders = user_doc.to_dict().get('orders', {})
-            
-            if order_id in orders:
-                # Update the payment status for the specific order
-                user_ref.update({
-                    f'orders.{order_id}.payment_status': status
-                })
-                logging.info(f"Order {order_id} updated with payment status: {status}")
-            else:
-                logging.error(f"No matching order found for {order_id} under email {customer_email}")
-        else:
-            logging.error(f"No user found with email {customer_email}")
+        with metrics.span('firestore', 'update_status'):
+            return status_writer.update(order_id, status, customer_email)
     except Exception as e:
         logging.error(f"Error updating order status: {e}")
+        return False
+
+
+metrics.register_collector(webhook_queue.metrics_lines)
+metrics.register_collector(webhook_intake.metrics_lines)
+metrics.register_collector(cashfree.guard.metrics_lines)
+
+
+# Re-checks orders stuck in pending against Cashfree; lookups also refresh the order cache
+reconciler = Reconciler(
+    db, cashfree, status_writer,
+    workers=int(os.getenv('RECONCILE_WORKERS', '8')),
+    rate=float(os.getenv('RECONCILE_RATE', '5')),
+    page_size=int(os.getenv('RECONCILE_PAGE_SIZE', '200')),
+    on_order=order_cache.put,
+)
+RECONCILE_CHECKPOINT = os.getenv('RECONCILE_CHECKPOINT', '.reconcile.checkpoint')
+RECONCILE_LOCK_PATH = os.getenv('RECONCILE_LOCK_PATH', '.reconcile.lock')
+
+# Set RECONCILE_INTERVAL_SECONDS to run a pass periodically in one worker per host
+reconcile_job = None
+if float(os.getenv('RECONCILE_INTERVAL_SECONDS', '0')) > 0:
+    reconcile_job = ReconcileJob(
+        reconciler,
+        interval=float(os.environ['RECONCILE_INTERVAL_SECONDS']),
+        checkpoint_path=RECONCILE_CHECKPOINT,
+        lock_path=RECONCILE_LOCK_PATH,
+    )
+
+_background_started = False
+_background_lock = threading.Lock()
+
+
+@app.before_request
+def start_background_work():
+    """Starts the webhook workers and the reconcile job with the first request.
+
+    Importing the app for a CLI command (flask reconcile-orders, ...) must
+    not start them.
+    """
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        webhook_workers.start()
+        if reconcile_job:
+            reconcile_job.start()
+        _background_started = True
 
 
 
@@ -347,10 +475,13 @@ def payment_notification():
 
         if order_id and payment_status:
             if payment_status == 'SUCCESS':
+                order_cache.invalidate(order_id)
+
                 # Update the order status in Firestore
-                orders_ref = db.collection('orders')
-                order_ref = orders_ref.document(order_id)
-                order_ref.update({'payment_status': 'Order Completed'})
+                with metrics.span('firestore', 'update_status'):
+                    updated = status_writer.update(order_id, 'Order Completed')
+                if not updated:
+                    return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
                 return jsonify({'status': 'success', 'message': 'Payment status updated'}), 200
             else:
                 # Handle other statuses or errors as needed
@@ -362,6 +493,54 @@ def payment_notification():
         return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
 
+@app.cli.command('migrate-orders')
+@click.option('--page-size', default=100, show_default=True, help='User documents read per page.')
+@click.option('--batch-size', default=400, show_default=True, help='Index writes per batch commit.')
+@click.option('--checkpoint', default='.migrate_orders.checkpoint', show_default=True,
+              help='File recording the last migrated user, used to resume.')
+@click.option('--dry-run', is_flag=True, help='Read and count without writing.')
+def migrate_orders_command(page_size, batch_size, checkpoint, dry_run):
+    """Backfill orders/{order_id} from the orders map on each user document."""
+    users, orders = migrate_user_orders(db, page_size=page_size, checkpoint_path=checkpoint,
+                                        batch_size=batch_size, dry_run=dry_run, echo=click.echo)
+    click.echo(f"Done: {orders} orders from {users} users")
+
+
+@app.cli.command('reconcile-orders')
+@click.option('--workers', default=None, type=int, help='Concurrent Cashfree lookups.')
+@click.option('--rate', default=None, type=float, help='Cashfree lookups per second; 0 for no limit.')
+@click.option('--page-size', default=None, type=int, help='Pending orders read per page.')
+@click.option('--max-orders', default=None, type=int, help='Stop after this many orders.')
+@click.option('--checkpoint', default=RECONCILE_CHECKPOINT, show_default=True,
+              help='File recording the last reconciled order, used to resume.')
+def reconcile_orders_command(workers, rate, page_size, max_orders, checkpoint):
+    """Check pending orders against Cashfree and fix their status."""
+    runner = Reconciler(
+        db, cashfree, status_writer,
+        workers=workers or reconciler.workers,
+        rate=reconciler.rate if rate is None else rate,
+        page_size=page_size or reconciler.page_size,
+        on_order=order_cache.put,
+    )
+    # Same lock as the periodic job, so the two never share a checkpoint at once
+    lock_file = acquire_lock(RECONCILE_LOCK_PATH)
+    if lock_file is None:
+        raise click.ClickException(f"Another reconciliation is running (lock held on {RECONCILE_LOCK_PATH})")
+    try:
+        stats = runner.run(checkpoint_path=checkpoint, max_orders=max_orders, echo=click.echo)
+    finally:
+        lock_file.close()
+    click.echo(f"Done: {stats}")
+
+
+@app.cli.command('requeue-webhooks')
+@click.argument('event_ids', nargs=-1, type=int)
+def requeue_webhooks_command(event_ids):
+    """Retry dead webhook events (all of them, or just EVENT_IDS)."""
+    count = webhook_queue.requeue_dead(event_ids)
+    click.echo(f"Requeued {count} dead webhook events; the server's workers will pick them up")
+
+
 if __name__ == '__main__':
     app.run(debug=False)
     # app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,375 @@
+"""Async (ASGI) version of the payment service.
+
+Serves the same routes as app.py on Quart, with httpx for Cashfree and
+Firestore's AsyncClient, so one process can hold many payment flows while
+they wait on I/O. Run it with:
+
+    gunicorn asgi_app:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from quart import Quart, g, jsonify, request
+from quart_cors import cors
+
+import firebase_db
+import metrics
+from cashfree_async import AsyncCashfreeClient
+from circuit_breaker import UpstreamUnavailable
+from idempotency import Idempotent
+from log_config import configure_logging, log_payload, log_request
+from order_cache import AsyncOrderStatusCache, shared_cache_from_env
+from order_index import get_order_record_async
+from order_writer import OrderStatusWriter
+from webhook_filter import WebhookIntake
+from webhook_queue import WebhookQueue, WebhookWorkerPool, parse_webhook, status_update_handler
+
+load_dotenv()
+
+configure_logging()
+
+app = cors(Quart(__name__), allow_origin='*')
+
+RETURN_URL = 'https://teerkhelo.web.app/payment_response?order_id={order_id}'
+NOTIFY_URL = 'https://cf-py-bvfc.onrender.com/webhook'
+
+# Firestore is resolved on first use (see firebase_db); the Cashfree client
+# is created on startup, inside the serving event loop
+db = firebase_db.LazyClient(firebase_db.get_async_db)
+cashfree = None
+
+# Status updates share app.py's batching writer. It commits on its own
+# thread, so it uses the sync client and never blocks the event loop.
+status_writer = OrderStatusWriter.from_env(firebase_db.LazyClient())
+
+# ORDER_CACHE_PATH shares cached entries with the other workers on the host
+shared_cache = shared_cache_from_env()
+order_cache = AsyncOrderStatusCache.from_env(lambda order_id: cashfree.get_order(order_id), shared=shared_cache)
+idempotent = Idempotent.from_env(shared=shared_cache)
+
+webhook_queue = WebhookQueue.from_env()
+webhook_workers = WebhookWorkerPool.from_env(webhook_queue, status_update_handler(status_writer))
+webhook_intake = WebhookIntake.from_env(webhook_queue, order_cache, shared=shared_cache,
+                                        on_queued=webhook_workers.notify)
+
+metrics.register_collector(webhook_queue.metrics_lines)
+metrics.register_collector(webhook_intake.metrics_lines)
+metrics.register_collector(lambda: cashfree.guard.metrics_lines() if cashfree else [])
+
+
+@app.before_serving
+async def startup():
+    global cashfree
+    if os.getenv('FIREBASE_INIT', 'background') == 'background':
+        firebase_db.warm_up('async')
+    cashfree = AsyncCashfreeClient.from_env()
+    webhook_workers.start()
+
+
+@app.after_serving
+async def shutdown():
+    await asyncio.to_thread(webhook_workers.stop)
+    await cashfree.aclose()
+
+
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+    metrics.start_request()
+
+
+@app.after_request
+async def log_access(response):
+    if 'started' in g:
+        # Timing and logging must never change the response
+        try:
+            order_id = request.args.get('order_id')
+            if order_id is None and request.is_json:
+                data = await request.get_json(silent=True)
+                if isinstance(data, dict):
+                    order_id = data.get('order_id') or parse_webhook(data)[0]
+            # Unknown paths share one label so scanners can't add series
+            route = request.endpoint or 'unmatched'
+            queued = metrics.queue_time(request.headers.get('X-Request-Start'))
+            response.headers['Server-Timing'] = metrics.finish_request(
+                route, response.status_code, time.perf_counter() - g.started, queued)
+            log_request(app.logger, route, response.status_code, g.started, order_id=order_id)
+        except Exception as e:
+            app.logger.error(f"Error recording request: {e}")
+    return response
+
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.route('/')
+async def home():
+    return "Application is running", 200
+
+
+@app.route('/ready')
+async def ready():
+    if firebase_db.is_ready('async'):
+        return jsonify({'status': 'ready'}), 200
+    firebase_db.warm_up('async')
+    return jsonify({'status': 'starting', 'error': firebase_db.warm_up_error()}), 503
+
+
+@app.errorhandler(UpstreamUnavailable)
+async def upstream_unavailable(e):
+    # Raised before Cashfree is called, so the client can safely retry
+    app.logger.warning(f"Rejected Cashfree call: {e}")
+    return (jsonify({'error': 'Payment provider unavailable, please retry', 'retry_after': e.retry_after}),
+            503, {'Retry-After': str(e.retry_after)})
+
+
+async def existing_payment_session(order_id, customer_email):
+    check_response = await cashfree.get_order(order_id)
+    if check_response.status_code == 200:
+        check_data = check_response.json()
+        owner = (check_data.get('customer_details') or {}).get('customer_email')
+        if check_data.get('order_status') == 'ACTIVE' and owner == customer_email:
+            return check_data.get('payment_session_id')
+    return None
+
+
+@app.route('/create_order', methods=['POST'])
+async def create_order():
+    try:
+        data = await request.get_json()
+        body, status = await idempotent.run_async('create_order', data, _create_order)
+        return jsonify(body), status
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+async def _create_order(data):
+    order_id = data.get('order_id')
+    user_email = data.get('customer_email')
+
+    payload = {
+        'order_id': order_id,
+        'order_amount': data.get('order_amount'),
+        'order_currency': 'INR',
+        'customer_details': {
+            'customer_id': data.get('customer_id', 'default_customer_id'),
+            'customer_name': data.get('customer_name'),
+            'customer_email': user_email,
+            'customer_phone': '0000000000'  # Use dummy phone number here
+        },
+        'order_meta': {
+            'return_url': RETURN_URL.format(order_id=order_id),
+            'notify_url': NOTIFY_URL
+        }
+    }
+
+    response = await cashfree.create_order(payload)
+    response_data = response.json()
+    log_payload(app.logger, 'create_order', "Cashfree response data", response_data,
+                order_id=order_id, status=response.status_code)
+
+    if response.status_code == 200:
+        payment_session_id = response_data.get('payment_session_id', '')
+
+        with metrics.span('firestore', 'set_order'):
+            await db.collection('orders').document(order_id).set({
+                'order_amount': data.get('order_amount'),
+                'payment_session_id': payment_session_id,
+                'payment_status': 'pending',
+                'original_order_id': None,
+                'customer_email': user_email,
+                'customer_name': data.get('customer_name')
+            })
+        return {'order_id': order_id, 'payment_session_id': payment_session_id}, 200
+    elif response.status_code == 409:
+        payment_session_id = await existing_payment_session(order_id, user_email)
+        if payment_session_id:
+            return {'order_id': order_id, 'payment_session_id': payment_session_id}, 200
+    return {'error': response_data.get('message', 'Unknown error occurred')}, response.status_code
+
+
+# RESUME PAYMENT
+@app.route('/resume_payment', methods=['POST'])
+async def resume_payment():
+    try:
+        data = await request.get_json()
+        body, status = await idempotent.run_async('resume_payment', data, _resume_payment)
+        return jsonify(body), status
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        app.logger.error(f"An error occurred: {str(e)}")
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+async def _resume_payment(data):
+    order_id = data.get('order_id')
+    user_email = data.get('customer_email')
+
+    # The Firestore lookup and the Cashfree order check are independent, so
+    # the check starts right away. A stored session doesn't need Cashfree, so
+    # the check is cancelled (and its errors ignored) unless it's needed.
+    check = asyncio.create_task(cashfree.get_order(order_id))
+    try:
+        with metrics.span('firestore', 'get_order'):
+            order_details = await get_order_record_async(db, order_id, user_email)
+
+        if order_details is None:
+            return {'error': 'Order ID not found in user orders'}, 404
+
+        stored_payment_session_id = order_details.get('payment_session_id')
+        if stored_payment_session_id:
+            app.logger.info("Using stored payment session ID for order %s", order_id, extra={'order_id': order_id})
+            return {'order_id': order_id, 'payment_session_id': stored_payment_session_id}, 200
+
+        check_response = await check
+    finally:
+        # No-op once the check has been awaited
+        check.cancel()
+
+    if check_response.status_code == 200:
+        check_data = check_response.json()
+        if check_data.get('order_status') in ['PAID', 'EXPIRED']:
+            # Create a new order with a new ID
+            new_order_id = f"{order_id}_retry_{int(time.time())}"
+        else:
+            # Use existing order ID and payment session
+            return {'order_id': order_id, 'payment_session_id': check_data.get('payment_session_id')}, 200
+    else:
+        app.logger.info("Order %s not found in Cashfree. Creating new payment session.", order_id,
+                        extra={'order_id': order_id})
+        new_order_id = order_id
+
+    payload = {
+        'order_id': new_order_id,
+        'order_amount': order_details.get('order_amount'),
+        'order_currency': 'INR',
+        'customer_details': {
+            'customer_id': f'customer_{new_order_id}',
+            'customer_name': order_details.get('customer_name') or 'Customer',
+            'customer_email': user_email,
+        },
+        'order_meta': {
+            'return_url': RETURN_URL.format(order_id=order_id),
+            'notify_url': NOTIFY_URL
+        }
+    }
+
+    response = await cashfree.create_order(payload)
+    response_data = response.json()
+    log_payload(app.logger, 'resume_payment', "Cashfree response", response_data,
+                order_id=new_order_id, status=response.status_code)
+
+    if response.status_code == 200:
+        payment_session_id = response_data.get('payment_session_id', '')
+        new_order = {
+            'order_amount': order_details.get('order_amount'),
+            'payment_session_id': payment_session_id,
+            'payment_status': 'pending',
+            'original_order_id': order_id if new_order_id != order_id else None
+        }
+
+        batch = db.batch()
+        batch.set(db.collection('orders').document(new_order_id), {
+            **new_order,
+            'customer_email': user_email,
+            'customer_name': order_details.get('customer_name'),
+        }, merge=True)
+        batch.set(db.collection('users').document(user_email), {
+            'orders': {new_order_id: new_order}
+        }, merge=True)
+        with metrics.span('firestore', 'commit_order'):
+            await batch.commit()
+        return {'order_id': new_order_id, 'payment_session_id': payment_session_id}, 200
+    elif response.status_code == 409:
+        payment_session_id = await existing_payment_session(new_order_id, user_email)
+        if payment_session_id:
+            return {'order_id': new_order_id, 'payment_session_id': payment_session_id}, 200
+    return {'error': response_data.get('message', 'Unknown error occurred')}, response.status_code
+
+
+@app.route('/payment_response', methods=['GET'])
+async def payment_response():
+    order_id = request.args.get('order_id')
+
+    # Verify the payment with Cashfree
+    try:
+        with metrics.span('cache', 'order_status'):
+            verification_status, verification_data = await order_cache.get(order_id)
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error verifying payment for order {order_id}: {str(e)}")
+        return jsonify({'error': 'Payment verification unavailable', 'order_id': order_id}), 502
+
+    if verification_status == 200 and verification_data.get('order_status') == 'PAID':
+        customer_email = (verification_data.get('customer_details') or {}).get('customer_email')
+        await update_order_status(order_id, 'Order Completed', customer_email)
+        return jsonify({
+            'message': 'Payment verified',
+            'order_id': order_id,
+            'redirect_url': 'image_screen',
+        })
+    else:
+        return jsonify({
+            'message': 'Payment verification failed',
+            'order_id': order_id,
+        })
+
+
+@app.route('/webhook', methods=['POST'])
+async def webhook():
+    try:
+        body, status = await asyncio.to_thread(webhook_intake.handle, await request.get_data(), request.headers)
+        return jsonify(body), status
+
+    except Exception as e:
+        logging.error(f"Error processing webhook: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route('/webhook/queue', methods=['GET'])
+async def webhook_queue_depth():
+    return jsonify(await asyncio.to_thread(webhook_queue.depth)), 200
+
+
+async def update_order_status(order_id, status, customer_email):
+    """Returns False only when the update failed and is worth retrying."""
+    try:
+        with metrics.span('firestore', 'update_status'):
+            future = status_writer.submit(order_id, status, customer_email)
+            return await asyncio.wait_for(asyncio.wrap_future(future), 10)
+    except Exception as e:
+        logging.error(f"Error updating order status: {e}")
+        return False
+
+
+@app.route('/payment_notification', methods=['POST'])
+async def payment_notification():
+    try:
+        data = await request.get_json()
+        order_id = data.get('order_id')
+        payment_status = data.get('payment_status')
+
+        if order_id and payment_status:
+            if payment_status == 'SUCCESS':
+                await asyncio.to_thread(order_cache.invalidate, order_id)
+
+                # Update the order status in Firestore
+                if not await update_order_status(order_id, 'Order Completed', None):
+                    return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
+                return jsonify({'status': 'success', 'message': 'Payment status updated'}), 200
+            else:
+                return jsonify({'status': 'failure', 'message': 'Payment not successful'}), 200
+        else:
+            return jsonify({'status': 'error', 'message': 'Invalid data received'}), 400
+    except Exception as e:
+        logging.error(f"Error processing payment notification: {e}")
+        return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
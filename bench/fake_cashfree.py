@@ -0,0 +1,128 @@
+"""Local stand-in for the Cashfree /pg/orders API.
+
+    POST /pg/orders            create an order (409 if the id exists)
+    GET  /pg/orders/<order_id> fetch an order
+
+Latency, 5xx rate and spurious 409 rate are configurable, and a share of
+orders are reported as PAID once created so redirect polling sees both
+states. Run standalone with `python bench/fake_cashfree.py --port 8181`.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeCashfree:
+    def __init__(self, latency_ms=80.0, jitter_ms=40.0, error_rate=0.0, conflict_rate=0.0, paid_rate=0.5):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.conflict_rate = conflict_rate
+        self.paid_rate = paid_rate
+        self.orders = {}
+        self.calls = {'create': 0, 'get': 0, 'errors': 0, 'conflicts': 0}
+        self._lock = threading.Lock()
+
+    def sleep(self):
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+
+    def create(self, payload):
+        with self._lock:
+            self.calls['create'] += 1
+        self.sleep()
+        if random.random() < self.error_rate:
+            return self._error(503, 'Service unavailable', 'api_error')
+
+        order_id = payload.get('order_id')
+        with self._lock:
+            if order_id in self.orders or random.random() < self.conflict_rate:
+                self.calls['conflicts'] += 1
+                return 409, {'message': 'order with same id is already present',
+                             'code': 'order_already_exists', 'type': 'invalid_request_error'}
+            order = {
+                'cf_order_id': str(random.randint(10 ** 9, 10 ** 10)),
+                'order_id': order_id,
+                'order_amount': payload.get('order_amount'),
+                'order_currency': payload.get('order_currency', 'INR'),
+                'customer_details': payload.get('customer_details', {}),
+                'order_meta': payload.get('order_meta', {}),
+                'order_status': 'PAID' if random.random() < self.paid_rate else 'ACTIVE',
+                'payment_session_id': f'session_{uuid.uuid4().hex}',
+            }
+            self.orders[order_id] = order
+        return 200, order
+
+    def get(self, order_id):
+        with self._lock:
+            self.calls['get'] += 1
+        self.sleep()
+        if random.random() < self.error_rate:
+            return self._error(502, 'Bad gateway', 'api_error')
+        with self._lock:
+            order = self.orders.get(order_id)
+        if order is None:
+            return 404, {'message': 'order not found', 'code': 'order_not_found', 'type': 'invalid_request_error'}
+        return 200, order
+
+    def _error(self, status, message, kind):
+        with self._lock:
+            self.calls['errors'] += 1
+        return status, {'message': message, 'code': kind, 'type': kind}
+
+
+def make_server(fake, host='127.0.0.1', port=0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if self.path.rstrip('/') != '/pg/orders':
+                return self._send(404, {'message': 'not found'})
+            self._send(*fake.create(payload))
+
+        def do_GET(self):
+            prefix = '/pg/orders/'
+            if not self.path.startswith(prefix):
+                return self._send(404, {'message': 'not found'})
+            self._send(*fake.get(self.path[len(prefix):]))
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Cashfree orders API')
+    parser.add_argument('--port', type=int, default=8181)
+    parser.add_argument('--latency-ms', type=float, default=80.0)
+    parser.add_argument('--jitter-ms', type=float, default=40.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--conflict-rate', type=float, default=0.0)
+    parser.add_argument('--paid-rate', type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake = FakeCashfree(args.latency_ms, args.jitter_ms, args.error_rate, args.conflict_rate, args.paid_rate)
+    server = make_server(fake, port=args.port)
+    print(f"Fake Cashfree listening on http://127.0.0.1:{server.server_port}/pg/orders")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""In-memory stand-in for the parts of the Firestore client the app uses.
+
+Supports document get/set/update (dotted field paths, merge), write
+batches, and collection queries with where/order_by/limit/start_after.
+Install it with firebase_db.set_db(FakeFirestore()) before the first
+Firestore call. For a real server, point FIRESTORE_EMULATOR_HOST at the
+Firestore emulator instead.
+"""
+import copy
+import threading
+import time
+
+from google.api_core.exceptions import NotFound
+
+DOCUMENT_ID = '__name__'
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._docs = {}
+        self._lock = threading.RLock()
+        self.operations = 0
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references):
+        self._wait()
+        with self._lock:
+            return [DocumentSnapshot(ref, copy.deepcopy(self._docs.get(ref.path))) for ref in references]
+
+    def _wait(self):
+        self.operations += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return _get_path(self._data or {}, field)
+
+
+class DocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.collection_name = collection
+        self.id = doc_id
+        self.path = f'{collection}/{doc_id}'
+
+    def get(self):
+        self._client._wait()
+        with self._client._lock:
+            return DocumentSnapshot(self, copy.deepcopy(self._client._docs.get(self.path)))
+
+    def set(self, data, merge=False):
+        self._client._wait()
+        with self._client._lock:
+            self._apply_set(data, merge)
+
+    def update(self, data):
+        self._client._wait()
+        with self._client._lock:
+            self._check_exists()
+            self._apply_update(data)
+
+    def _check_exists(self):
+        if self.path not in self._client._docs:
+            raise NotFound(f'No document to update: {self.path}')
+
+    def _apply_set(self, data, merge):
+        docs = self._client._docs
+        if merge and self.path in docs:
+            _deep_merge(docs[self.path], copy.deepcopy(data))
+        else:
+            docs[self.path] = copy.deepcopy(data)
+
+    def _apply_update(self, data):
+        doc = self._client._docs[self.path]
+        for field, value in data.items():
+            _set_path(doc, field, copy.deepcopy(value))
+
+
+class Query:
+    def __init__(self, client, collection, filters=(), order=None, limit_to=None, cursor=None):
+        self._client = client
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit_to
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, limit_to=self._limit, cursor=self._cursor)
+        state.update(changes)
+        return Query(self._client, self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction=None):
+        return self._copy(order=_field_name(field_path))
+
+    def limit(self, count):
+        return self._copy(limit_to=count)
+
+    def start_after(self, values):
+        if isinstance(values, DocumentSnapshot):
+            values = {DOCUMENT_ID: values.id, **(values.to_dict() or {})}
+        values = {_field_name(key): value for key, value in values.items()}
+        return self._copy(cursor=values)
+
+    def stream(self):
+        self._client._wait()
+        prefix = f'{self._collection}/'
+        with self._client._lock:
+            rows = [(path[len(prefix):], copy.deepcopy(data)) for path, data in self._client._docs.items()
+                    if path.startswith(prefix) and '/' not in path[len(prefix):]]
+
+        for field, op, value in self._filters:
+            rows = [row for row in rows if _matches(_row_value(row, _field_name(field)), op, value)]
+
+        order = self._order or DOCUMENT_ID
+
+        def key(row):
+            if order == DOCUMENT_ID:
+                return (row[0],)
+            return (_sort_key(_row_value(row, order)), row[0])
+
+        rows.sort(key=key)
+        if self._cursor is not None:
+            if order == DOCUMENT_ID:
+                after = (self._cursor[DOCUMENT_ID],)
+            else:
+                after = (_sort_key(self._cursor.get(order)), self._cursor.get(DOCUMENT_ID, ''))
+            rows = [row for row in rows if key(row) > after]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        for doc_id, data in rows:
+            yield DocumentSnapshot(DocumentReference(self._client, self._collection, doc_id), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id):
+        return DocumentReference(self._client, self._collection, doc_id)
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, None))
+
+    def commit(self):
+        self._client._wait()
+        with self._client._lock:
+            # All or nothing, like Firestore
+            for kind, reference, _, _ in self._writes:
+                if kind == 'update':
+                    reference._check_exists()
+            for kind, reference, data, merge in self._writes:
+                if kind == 'set':
+                    reference._apply_set(data, merge)
+                else:
+                    reference._apply_update(data)
+        self._writes = []
+
+
+def _field_name(field_path):
+    if isinstance(field_path, str):
+        return field_path
+    # FieldPath.document_id() and friends
+    to_api_repr = getattr(field_path, 'to_api_repr', None)
+    return to_api_repr() if to_api_repr else str(field_path)
+
+
+def _row_value(row, field):
+    doc_id, data = row
+    if field == DOCUMENT_ID:
+        return doc_id
+    return _get_path(data, field)
+
+
+def _get_path(data, field):
+    for part in field.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+def _set_path(data, field, value):
+    parts = field.split('.')
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+
+def _deep_merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _sort_key(value):
+    return (value is None, type(value).__name__, value if value is not None else 0)
+
+
+def _matches(actual, op, expected):
+    if op == '==':
+        return actual == expected
+    if op == '!=':
+        return actual != expected
+    if op == 'in':
+        return actual in expected
+    if actual is None:
+        return False
+    if op == '<':
+        return actual < expected
+    if op == '<=':
+        return actual <= expected
+    if op == '>':
+        return actual > expected
+    if op == '>=':
+        return actual >= expected
+    raise ValueError(f'Unsupported operator {op}')
@@ -0,0 +1,314 @@
+"""Offline load test for the payment service.
+
+By default the Flask app is served in-process against local stand-ins: a
+fake Cashfree API (bench/fake_cashfree.py) and an in-memory Firestore
+(bench/fake_firestore.py). Workers replay a weighted mix of create_order,
+resume_payment, redirect polling and webhook traffic, and the run ends with
+requests/s and latency percentiles per endpoint:
+
+    python bench/loadtest.py --duration 30 --concurrency 32 \\
+        --mix create=2,resume=2,poll=6,webhook=4 --cashfree-error-rate 0.02
+
+Use --target to drive an already running server instead (for example
+gunicorn with another worker class, against the fake Cashfree server and
+the Firestore emulator) so worker models can be compared.
+"""
+import argparse
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_cashfree import FakeCashfree, make_server  # noqa: E402
+
+# Shape of a Cashfree PAYMENT_CHARGES_WEBHOOK delivery as it appears in our logs
+WEBHOOK_TEMPLATE = {
+    'data': {
+        'order': {'order_id': None, 'order_amount': 10.0, 'order_currency': 'INR', 'order_tags': None},
+        'payment': {
+            'cf_payment_id': None, 'payment_status': 'SUCCESS', 'payment_amount': 10.0,
+            'payment_currency': 'INR', 'payment_message': 'Simulated response message',
+            'payment_time': '2024-09-21T10:27:13+05:30', 'bank_reference': '1234567890', 'auth_id': None,
+            'payment_method': {'upi': {'channel': None, 'upi_id': 'testsuccess@gocash'}},
+            'payment_group': 'upi',
+        },
+        'customer_details': {
+            'customer_name': 'bench', 'customer_id': 'default_customer_id',
+            'customer_email': None, 'customer_phone': '0000000000',
+        },
+        'charges_details': {
+            'service_charge': 0.19, 'service_tax': 0.03, 'settlement_amount': 9.78,
+            'settlement_currency': 'INR', 'service_charge_discount': None,
+        },
+    },
+    'event_time': '2024-09-21T10:27:31+05:30',
+    'type': 'PAYMENT_CHARGES_WEBHOOK',
+}
+WEBHOOK_STATUSES = ('SUCCESS', 'SUCCESS', 'SUCCESS', 'FAILED', 'USER_DROPPED')
+
+
+def webhook_payload(order_id, email, status):
+    payload = copy.deepcopy(WEBHOOK_TEMPLATE)
+    payload['data']['order']['order_id'] = order_id
+    payload['data']['payment']['cf_payment_id'] = random.randint(10 ** 12, 10 ** 13)
+    payload['data']['payment']['payment_status'] = status
+    payload['data']['customer_details']['customer_email'] = email
+    return payload
+
+
+def signed_webhook(payload, secret):
+    """Body and x-webhook-* headers the way Cashfree signs a delivery."""
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time() * 1000))
+    digest = hmac.new(secret.encode(), timestamp.encode() + body, hashlib.sha256).digest()
+    headers = {'Content-Type': 'application/json', 'x-webhook-timestamp': timestamp,
+               'x-webhook-signature': base64.b64encode(digest).decode()}
+    return body, headers
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class Orders:
+    """Orders created during the run, for resume/poll/webhook traffic."""
+
+    def __init__(self, seed_user_doc=None):
+        self._orders = []
+        self._lock = threading.Lock()
+        self.seed_user_doc = seed_user_doc
+
+    def add(self, order_id, email, amount):
+        if self.seed_user_doc:
+            self.seed_user_doc(order_id, email, amount)
+        with self._lock:
+            self._orders.append((order_id, email))
+
+    def pick(self):
+        with self._lock:
+            return random.choice(self._orders) if self._orders else None
+
+
+def run_operation(name, session, base_url, orders, recorder, duplicate_rate, webhook_secret):
+    picked = orders.pick()
+    if name != 'create' and picked is None:
+        name = 'create'
+
+    if name == 'create':
+        order_id = f'bench{uuid.uuid4().hex[:10]}'
+        email = f'user{random.randint(1, 500)}@bench.test'
+        amount = random.choice(['1', '10', '50'])
+        body = {'order_id': order_id, 'order_amount': amount, 'customer_email': email,
+                'customer_name': 'Bench User', 'customer_id': 'bench'}
+        ok = timed(recorder, '/create_order', lambda: session.post(f'{base_url}/create_order', json=body))
+        if ok:
+            orders.add(order_id, email, amount)
+    elif name == 'resume':
+        order_id, email = picked
+        body = {'order_id': order_id, 'customer_email': email}
+        send = lambda: timed(recorder, '/resume_payment', lambda: requests.post(f'{base_url}/resume_payment', json=body))  # noqa: E731
+        if random.random() < duplicate_rate:
+            # Mobile clients double-submit; fire the duplicate concurrently
+            duplicate = threading.Thread(target=send)
+            duplicate.start()
+            send()
+            duplicate.join()
+        else:
+            timed(recorder, '/resume_payment', lambda: session.post(f'{base_url}/resume_payment', json=body))
+    elif name == 'poll':
+        order_id, _ = picked
+        timed(recorder, '/payment_response',
+              lambda: session.get(f'{base_url}/payment_response', params={'order_id': order_id}))
+    elif name == 'webhook':
+        order_id, email = picked
+        payload = webhook_payload(order_id, email, random.choice(WEBHOOK_STATUSES))
+        body, headers = signed_webhook(payload, webhook_secret)
+        timed(recorder, '/webhook', lambda: session.post(f'{base_url}/webhook', data=body, headers=headers))
+        if random.random() < duplicate_rate:
+            # Cashfree redelivers when it doesn't see a 200 in time
+            timed(recorder, '/webhook', lambda: session.post(f'{base_url}/webhook', data=body, headers=headers))
+
+
+def timed(recorder, endpoint, call):
+    start = time.perf_counter()
+    try:
+        response = call()
+        ok = response.status_code < 500 and response.status_code != 409
+    except requests.RequestException:
+        ok = False
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+    return ok
+
+
+def worker(deadline, mix, base_url, orders, recorder, duplicate_rate, webhook_secret):
+    names, weights = zip(*mix.items())
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        run_operation(random.choices(names, weights)[0], session, base_url, orders, recorder, duplicate_rate,
+                      webhook_secret)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+
+
+def report(recorder, elapsed):
+    rows = []
+    for endpoint, samples in sorted(recorder.samples.items()):
+        rows.append({
+            'endpoint': endpoint,
+            'requests': len(samples),
+            'errors': recorder.errors[endpoint],
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(samples, 50) * 1000, 1),
+            'p95_ms': round(percentile(samples, 95) * 1000, 1),
+            'p99_ms': round(percentile(samples, 99) * 1000, 1),
+            'mean_ms': round(statistics.fmean(samples) * 1000, 1),
+        })
+    total = sum(row['requests'] for row in rows)
+    return {'elapsed_s': round(elapsed, 2), 'total_requests': total, 'total_rps': round(total / elapsed, 1),
+            'endpoints': rows}
+
+
+def print_report(result, upstream=None):
+    print(f"{'endpoint':<20}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for row in result['endpoints']:
+        print(f"{row['endpoint']:<20}{row['requests']:>10}{row['errors']:>8}{row['rps']:>9}"
+              f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+    print(f"total: {result['total_requests']} requests in {result['elapsed_s']} s ({result['total_rps']} req/s)")
+    if upstream:
+        print(f"upstream: {upstream}")
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in ('create', 'resume', 'poll', 'webhook'):
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}')
+        mix[name] = float(weight)
+    return mix
+
+
+def start_in_process(args, tmp):
+    """Serves app.app on a local port against the fake Cashfree and Firestore."""
+    fake = FakeCashfree(args.cashfree_latency_ms, args.cashfree_jitter_ms, args.cashfree_error_rate,
+                        args.cashfree_conflict_rate, args.paid_rate)
+    cashfree_server = make_server(fake)
+    threading.Thread(target=cashfree_server.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        'CASHFREE_API_URL': f'http://127.0.0.1:{cashfree_server.server_port}/pg/orders',
+        'CASHFREE_APP_ID': 'bench', 'CASHFREE_SECRET_KEY': args.webhook_secret,
+        'FIREBASE_INIT': 'lazy',
+        'WEBHOOK_QUEUE_PATH': os.path.join(tmp, 'webhook_queue.db'),
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+    })
+    if args.shared_cache:
+        os.environ['ORDER_CACHE_PATH'] = os.path.join(tmp, 'order_cache.db')
+
+    import firebase_db
+    from fake_firestore import FakeFirestore
+
+    db = FakeFirestore(latency=args.firestore_latency_ms / 1000)
+    firebase_db.set_db(db)
+
+    import app as service
+    from werkzeug.serving import make_server as make_wsgi_server
+
+    wsgi_server = make_wsgi_server('127.0.0.1', 0, service.app, threaded=True)
+    threading.Thread(target=wsgi_server.serve_forever, daemon=True).start()
+
+    def seed_user_doc(order_id, email, amount):
+        # The frontend records each order on the user document
+        db.collection('users').document(email).set({
+            'orders': {order_id: {'order_amount': amount, 'payment_status': 'pending'}}
+        }, merge=True)
+
+    return f'http://127.0.0.1:{wsgi_server.server_port}', fake, seed_user_doc, service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', help='Base URL of a running server; default serves app.py in-process.')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client threads.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('create=2,resume=2,poll=6,webhook=4'),
+                        help='Operation weights, e.g. create=2,resume=2,poll=6,webhook=4.')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1,
+                        help='Share of resume_payment calls sent twice concurrently and webhooks redelivered.')
+    parser.add_argument('--webhook-secret', default=os.getenv('CASHFREE_SECRET_KEY', 'bench'),
+                        help='Secret used to sign webhooks; must match the server.')
+    parser.add_argument('--cashfree-latency-ms', type=float, default=80.0)
+    parser.add_argument('--cashfree-jitter-ms', type=float, default=40.0)
+    parser.add_argument('--cashfree-error-rate', type=float, default=0.0, help='Share of 5xx responses.')
+    parser.add_argument('--cashfree-conflict-rate', type=float, default=0.0, help='Share of spurious 409s.')
+    parser.add_argument('--paid-rate', type=float, default=0.5, help='Share of orders reported PAID.')
+    parser.add_argument('--firestore-latency-ms', type=float, default=15.0)
+    parser.add_argument('--shared-cache', action='store_true', help='Enable the SQLite shared order cache.')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fake = service = None
+        orders = Orders()
+        if args.target:
+            base_url = args.target.rstrip('/')
+        else:
+            base_url, fake, seed_user_doc, service = start_in_process(args, tmp)
+            orders.seed_user_doc = seed_user_doc
+
+        recorder = Recorder()
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=worker, args=(deadline, args.mix, base_url, orders, recorder,
+                                                         args.duplicate_rate, args.webhook_secret))
+                   for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result = report(recorder, time.monotonic() - started)
+
+        upstream = None
+        if fake is not None:
+            upstream = dict(fake.calls)
+            result['cashfree_calls'] = upstream
+            result['webhook_queue'] = service.webhook_queue.depth()
+
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_report(result, upstream)
+            if service is not None:
+                print(f"webhook queue: {result['webhook_queue']}")
+
+
+if __name__ == '__main__':
+    main()
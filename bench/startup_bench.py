@@ -0,0 +1,112 @@
+"""Import-time and cold-start benchmark.
+
+Imports the app in fresh interpreters and reports how long the import and
+the first request take, plus the slowest modules from `python -X importtime`.
+Exits non-zero when a budget is exceeded or a module that should be deferred
+(firebase_admin, grpc, ...) is imported eagerly, so it can gate CI:
+
+    python bench/startup_bench.py --runs 5 --max-import-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ('firebase_admin', 'grpc', 'google.cloud.firestore', 'google.protobuf')
+
+SNIPPET = '''
+import json, sys, time
+t0 = time.perf_counter()
+import {module} as target
+t1 = time.perf_counter()
+first_request_ms = None
+app = getattr(target, 'app', None)
+if hasattr(app, 'test_client') and not hasattr(app, 'before_serving'):
+    app.test_client().get('/')
+    first_request_ms = (time.perf_counter() - t1) * 1000
+print(json.dumps({{
+    'import_ms': (t1 - t0) * 1000,
+    'first_request_ms': first_request_ms,
+    'modules': sorted(sys.modules),
+}}))
+'''
+
+
+def run_once(module, env):
+    with tempfile.TemporaryDirectory() as tmp:
+        run_env = dict(env)
+        run_env.setdefault('WEBHOOK_QUEUE_PATH', os.path.join(tmp, 'webhook_queue.db'))
+        run_env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_DIR, env.get('PYTHONPATH')]))
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', SNIPPET.format(module=module)],
+            cwd=tmp, env=run_env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{proc.stderr[-4000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['importtime'] = parse_importtime(proc.stderr)
+    return result
+
+
+def parse_importtime(stderr):
+    """Returns [(cumulative_us, module)] from `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = line.replace(':', '|', 1).split('|')
+        rows.append((int(cumulative_us), name.strip()))
+    return rows
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app', help='Module exposing `app` (default: app).')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--firebase-init', default='lazy', choices=('lazy', 'background', 'eager'),
+                        help='FIREBASE_INIT mode to benchmark (default: lazy).')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if the median import exceeds this.')
+    parser.add_argument('--max-first-request-ms', type=float, help='Fail if the median first request exceeds this.')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list.')
+    args = parser.parse_args()
+
+    env = dict(os.environ, FIREBASE_INIT=args.firebase_init)
+    results = [run_once(args.module, env) for _ in range(args.runs)]
+
+    import_ms = [r['import_ms'] for r in results]
+    first_ms = [r['first_request_ms'] for r in results if r['first_request_ms'] is not None]
+    print(f"import {args.module} (FIREBASE_INIT={args.firebase_init}, {args.runs} runs): "
+          f"median {statistics.median(import_ms):.1f} ms, p90 {percentile(import_ms, 90):.1f} ms")
+    if first_ms:
+        print(f"first request: median {statistics.median(first_ms):.1f} ms, p90 {percentile(first_ms, 90):.1f} ms")
+
+    print("slowest imports (cumulative, last run):")
+    for cumulative_us, name in sorted(results[-1]['importtime'], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = [m for m in DEFERRED_MODULES if m in results[-1]['modules']]
+    if eager and args.firebase_init == 'lazy':
+        failures.append(f"deferred modules imported at startup: {', '.join(eager)}")
+    if args.max_import_ms is not None and statistics.median(import_ms) > args.max_import_ms:
+        failures.append(f"median import {statistics.median(import_ms):.1f} ms > {args.max_import_ms} ms")
+    if args.max_first_request_ms is not None and first_ms and statistics.median(first_ms) > args.max_first_request_ms:
+        failures.append(f"median first request {statistics.median(first_ms):.1f} ms > {args.max_first_request_ms} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
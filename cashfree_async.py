@@ -0,0 +1,85 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+import metrics
+from cashfree_client import CASHFREE_API_URL, CASHFREE_API_VERSION, settings_from_env, upstream_failed
+from circuit_breaker import UpstreamGuard
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncCashfreeClient:
+    """httpx-based counterpart of CashfreeClient for the ASGI app.
+
+    Create it inside the running event loop and close it on shutdown.
+    """
+
+    def __init__(self, app_id, secret_key, api_url=CASHFREE_API_URL,
+                 api_version=CASHFREE_API_VERSION, connect_timeout=3.05,
+                 read_timeout=10.0, pool_maxsize=100, max_retries=2,
+                 backoff_factor=0.3, backoff_jitter=0.3, max_concurrency=100,
+                 rate_limit=0, rate_burst=None, failure_threshold=5,
+                 reset_timeout=30.0, acquire_timeout=1.0):
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+
+        limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+        # Transport-level retries only cover connection failures, which are
+        # safe for POSTs too; GETs additionally retry in get_order.
+        transport = httpx.AsyncHTTPTransport(retries=max_retries, limits=limits)
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=read_timeout),
+            headers={
+                'Content-Type': 'application/json',
+                'x-client-id': app_id or '',
+                'x-client-secret': secret_key or '',
+                'x-api-version': api_version,
+            },
+        )
+        self.guard = UpstreamGuard(
+            'cashfree', max_concurrency=max_concurrency, rate=rate_limit, burst=rate_burst,
+            failure_threshold=failure_threshold, reset_timeout=reset_timeout,
+            acquire_timeout=acquire_timeout, is_failure=upstream_failed,
+        )
+
+    @classmethod
+    def from_env(cls):
+        settings = settings_from_env()
+        settings['pool_maxsize'] = int(os.getenv('CASHFREE_ASYNC_POOL_MAXSIZE', '100'))
+        settings['max_concurrency'] = int(os.getenv('CASHFREE_ASYNC_MAX_CONCURRENCY', '100'))
+        return cls(**settings)
+
+    async def create_order(self, payload):
+        async def post():
+            with metrics.span('cashfree', 'create_order'):
+                return await self.client.post(self.api_url, json=payload)
+        return await self.guard.acall(post)
+
+    async def get_order(self, order_id):
+        async def get():
+            with metrics.span('cashfree', 'get_order'):
+                return await self._get_order(order_id)
+        return await self.guard.acall(get)
+
+    async def _get_order(self, order_id):
+        url = f'{self.api_url}/{order_id}'
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.get(url)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_jitter))
+
+    async def aclose(self):
+        await self.client.aclose()
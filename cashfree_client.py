@@ -0,0 +1,109 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from circuit_breaker import UpstreamGuard
+
+CASHFREE_API_URL = "https://api.cashfree.com/pg/orders"
+# CASHFREE_API_URL = "https://sandbox.cashfree.com/pg/orders"
+CASHFREE_API_VERSION = '2023-08-01'
+
+
+def upstream_failed(response):
+    """Responses that count against the circuit breaker."""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class CashfreeClient:
+    """Pooled keep-alive client for the Cashfree orders API.
+
+    One instance is meant to live for the whole worker process so that TLS
+    sessions to api.cashfree.com are reused between requests.
+    """
+
+    def __init__(self, app_id, secret_key, api_url=CASHFREE_API_URL,
+                 api_version=CASHFREE_API_VERSION, connect_timeout=3.05,
+                 read_timeout=10.0, pool_connections=2, pool_maxsize=10,
+                 max_retries=2, backoff_factor=0.3, backoff_jitter=0.3,
+                 max_concurrency=10, rate_limit=0, rate_burst=None, failure_threshold=5,
+                 reset_timeout=30.0, acquire_timeout=1.0):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Fails fast with UpstreamUnavailable instead of queueing every
+        # worker thread behind a slow or failing Cashfree
+        self.guard = UpstreamGuard(
+            'cashfree', max_concurrency=max_concurrency, rate=rate_limit, burst=rate_burst,
+            failure_threshold=failure_threshold, reset_timeout=reset_timeout,
+            acquire_timeout=acquire_timeout, is_failure=upstream_failed,
+        )
+
+        # Only GETs are retried on read errors and 5xx responses. Connect
+        # errors are retried for every method since the request never left.
+        # Retry-After is ignored: urllib3 would sleep for whatever the header
+        # says, holding a worker thread far past the read timeout.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            allowed_methods=frozenset(['GET']),
+            status_forcelist=(429, 500, 502, 503, 504),
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=retry, pool_block=False)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'x-client-id': app_id or '',
+            'x-client-secret': secret_key or '',
+            'x-api-version': api_version,
+        })
+
+    @classmethod
+    def from_env(cls):
+        return cls(**settings_from_env())
+
+    def create_order(self, payload, timeout=None):
+        def post():
+            with metrics.span('cashfree', 'create_order'):
+                return self.session.post(self.api_url, json=payload, timeout=timeout or self.timeout)
+        return self.guard.call(post)
+
+    def get_order(self, order_id, timeout=None):
+        def get():
+            with metrics.span('cashfree', 'get_order'):
+                return self.session.get(f'{self.api_url}/{order_id}', timeout=timeout or self.timeout)
+        return self.guard.call(get)
+
+    def close(self):
+        self.session.close()
+
+
+def settings_from_env():
+    return dict(
+        app_id=os.getenv('CASHFREE_APP_ID'),
+        secret_key=os.getenv('CASHFREE_SECRET_KEY'),
+        api_url=os.getenv('CASHFREE_API_URL', CASHFREE_API_URL),
+        connect_timeout=float(os.getenv('CASHFREE_CONNECT_TIMEOUT', '3.05')),
+        read_timeout=float(os.getenv('CASHFREE_READ_TIMEOUT', '10')),
+        pool_maxsize=int(os.getenv('CASHFREE_POOL_MAXSIZE', '10')),
+        max_concurrency=int(os.getenv('CASHFREE_MAX_CONCURRENCY', '10')),
+        max_retries=int(os.getenv('CASHFREE_MAX_RETRIES', '2')),
+        backoff_factor=float(os.getenv('CASHFREE_BACKOFF_FACTOR', '0.3')),
+        # Per worker process; divide the account quota by the number of workers
+        rate_limit=float(os.getenv('CASHFREE_RATE_LIMIT', '0')),
+        failure_threshold=int(os.getenv('CASHFREE_BREAKER_FAILURES', '5')),
+        reset_timeout=float(os.getenv('CASHFREE_BREAKER_RESET_SECONDS', '30')),
+        acquire_timeout=float(os.getenv('CASHFREE_ACQUIRE_TIMEOUT', '1')),
+    )
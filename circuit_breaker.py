@@ -0,0 +1,219 @@
+"""Protects the service from a slow or failing upstream.
+
+UpstreamGuard wraps every outbound call with three checks: a circuit
+breaker, a per-process cap on concurrent calls and an optional token-bucket
+rate limit. A call that can't go ahead raises UpstreamUnavailable right away
+(or after a short wait for a slot) instead of tying up a worker, and the
+routes turn that into a 503 with Retry-After.
+
+After `failure_threshold` failures in a row the breaker opens and rejects
+calls for `reset_timeout` seconds. It then lets one probe through
+(half-open): success closes it again, failure reopens it.
+"""
+import asyncio
+import math
+import threading
+import time
+
+from rate_limit import TokenBucket
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+REJECT_REASONS = ('circuit_open', 'concurrency', 'rate_limited')
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not made; it is safe to retry after `retry_after` seconds."""
+
+    def __init__(self, name, reason, retry_after):
+        super().__init__(f"{name} unavailable ({reason}), retry after {retry_after}s")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed -> open -> half-open breaker.
+
+    allow() hands out a ticket that the caller passes back to record() or
+    cancel(). Tickets carry the breaker's generation, which moves on every
+    time it opens, so calls admitted before the breaker opened can't close
+    it again. While it isn't closed, only the half-open probe's result counts.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_total = 0
+        self._generation = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns (0, ticket) if a call may go ahead, otherwise (seconds until the next probe, None)."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0, (self._generation, False)
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == OPEN and remaining > 0:
+                return remaining, None
+            if self._probing:
+                return max(remaining, 1.0), None
+            self.state = HALF_OPEN
+            self._probing = True
+            return 0.0, (self._generation, True)
+
+    def cancel(self, ticket):
+        """Gives back a call allowed by allow() that was never made."""
+        with self._lock:
+            if ticket[1] and ticket[0] == self._generation:
+                self._probing = False
+
+    def record(self, ticket, ok):
+        generation, probe = ticket
+        with self._lock:
+            if generation != self._generation or (self.state != CLOSED and not probe):
+                return
+            if probe:
+                self._probing = False
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if probe or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_total += 1
+                self._generation += 1
+                self._opened_at = time.monotonic()
+
+
+class UpstreamGuard:
+    """Circuit breaker, concurrency cap and rate limit for calls to one upstream.
+
+    `is_failure(result)` decides which returned results count against the
+    breaker; exceptions always do. A rate of 0 turns the rate limit off.
+    """
+
+    def __init__(self, name, max_concurrency=10, rate=0, burst=None, failure_threshold=5,
+                 reset_timeout=30.0, acquire_timeout=1.0, is_failure=None):
+        self.name = name
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.limiter = TokenBucket(rate, burst) if rate > 0 else None
+        self.acquire_timeout = acquire_timeout
+        self.is_failure = is_failure or (lambda result: False)
+        self.in_flight = 0
+        self.rejected = dict.fromkeys(REJECT_REASONS, 0)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def call(self, fn):
+        ticket = self._check_breaker()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._reject('concurrency', 1, ticket)
+        try:
+            if self.limiter and not self.limiter.acquire(timeout=self.acquire_timeout):
+                self._reject('rate_limited', self._rate_retry_after(), ticket)
+            return self._observe(fn, ticket)
+        finally:
+            self._slots.release()
+
+    async def acall(self, fn):
+        ticket = self._check_breaker()
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._reject('concurrency', 1, ticket)
+        try:
+            if self.limiter and not await self._acquire_token():
+                self._reject('rate_limited', self._rate_retry_after(), ticket)
+            self._track(1)
+            try:
+                result = await fn()
+            except Exception:
+                self.breaker.record(ticket, False)
+                raise
+            finally:
+                self._track(-1)
+            self.breaker.record(ticket, not self.is_failure(result))
+            return result
+        finally:
+            self._async_slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.breaker.state,
+                'consecutive_failures': self.breaker.failures,
+                'opened_total': self.breaker.opened_total,
+                'in_flight': self.in_flight,
+                'rejected': dict(self.rejected),
+            }
+
+    def metrics_lines(self):
+        """Breaker state and rejections for metrics.register_collector."""
+        guard, name = self.snapshot(), self.name
+        lines = [f'# HELP {name}_circuit_state {name} circuit breaker state (1 for the current state).',
+                 f'# TYPE {name}_circuit_state gauge']
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            lines.append(f'{name}_circuit_state{{state="{state}"}} {int(guard["state"] == state)}')
+        lines += [f'# HELP {name}_circuit_opened_total Times the {name} circuit breaker has opened.',
+                  f'# TYPE {name}_circuit_opened_total counter',
+                  f'{name}_circuit_opened_total {guard["opened_total"]}',
+                  f'# HELP {name}_calls_in_flight {name} calls currently running in this process.',
+                  f'# TYPE {name}_calls_in_flight gauge',
+                  f'{name}_calls_in_flight {guard["in_flight"]}',
+                  f'# HELP {name}_calls_rejected_total {name} calls rejected before reaching the API.',
+                  f'# TYPE {name}_calls_rejected_total counter']
+        for reason in REJECT_REASONS:
+            lines.append(f'{name}_calls_rejected_total{{reason="{reason}"}} {guard["rejected"][reason]}')
+        return lines
+
+    def _observe(self, fn, ticket):
+        self._track(1)
+        try:
+            result = fn()
+        except Exception:
+            self.breaker.record(ticket, False)
+            raise
+        finally:
+            self._track(-1)
+        self.breaker.record(ticket, not self.is_failure(result))
+        return result
+
+    async def _acquire_token(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            wait = self.limiter.try_acquire()
+            if not wait:
+                return True
+            if deadline - time.monotonic() < wait:
+                return False
+            await asyncio.sleep(wait)
+
+    def _check_breaker(self):
+        wait, ticket = self.breaker.allow()
+        if ticket is None:
+            self._reject('circuit_open', math.ceil(wait))
+        return ticket
+
+    def _rate_retry_after(self):
+        return max(1, math.ceil(1 / self.limiter.rate))
+
+    def _reject(self, reason, retry_after, ticket=None):
+        if ticket is not None:
+            # Hand back a half-open probe that never reached the upstream
+            self.breaker.cancel(ticket)
+        with self._lock:
+            self.rejected[reason] += 1
+        raise UpstreamUnavailable(self.name, reason, retry_after)
+
+    def _track(self, delta):
+        with self._lock:
+            self.in_flight += delta
@@ -0,0 +1,106 @@
+"""Lazily initialised Firebase/Firestore clients.
+
+firebase_admin pulls in grpc, protobuf and google-cloud, which dominates
+import time. Nothing here is imported or initialised until the first
+Firestore call, or until warm_up() does it on a background thread.
+"""
+import base64
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_clients = {}
+_warm_up_thread = None
+_warm_up_error = None
+
+
+def _init_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if firebase_admin._apps:
+        return
+    # Read and decode the Firebase key
+    firebase_key_base64 = os.getenv('FIREBASE_KEY_BASE64')
+    if not firebase_key_base64:
+        raise ValueError("FIREBASE_KEY_BASE64 environment variable is not set")
+    firebase_key_json = base64.b64decode(firebase_key_base64).decode('utf-8')
+    cred = credentials.Certificate(json.loads(firebase_key_json))
+    firebase_admin.initialize_app(cred)
+
+
+def get_db():
+    """Returns the Firestore client, initialising Firebase on first use."""
+    client = _clients.get('sync')
+    if client is None:
+        with _lock:
+            client = _clients.get('sync')
+            if client is None:
+                from firebase_admin import firestore
+
+                _init_app()
+                client = _clients['sync'] = firestore.client()
+    return client
+
+
+def get_async_db():
+    """Returns Firestore's AsyncClient, initialising Firebase on first use."""
+    client = _clients.get('async')
+    if client is None:
+        with _lock:
+            client = _clients.get('async')
+            if client is None:
+                from firebase_admin import firestore_async
+
+                _init_app()
+                client = _clients['async'] = firestore_async.client()
+    return client
+
+
+def set_db(client, kind='sync'):
+    """Installs a ready-made client, e.g. an emulator or in-memory stand-in."""
+    with _lock:
+        _clients[kind] = client
+
+
+def is_ready(kind='sync'):
+    return kind in _clients
+
+
+def warm_up_error():
+    return _warm_up_error
+
+
+def warm_up(kind='sync'):
+    """Initialises the client on a daemon thread so requests don't pay for it."""
+    global _warm_up_thread
+    with _lock:
+        if kind in _clients or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        _warm_up_thread = threading.Thread(target=_warm_up, args=(kind,), name='firebase-warm-up', daemon=True)
+        _warm_up_thread.start()
+
+
+def _warm_up(kind):
+    global _warm_up_error
+    try:
+        get_async_db() if kind == 'async' else get_db()
+        _warm_up_error = None
+        logger.info("Firestore client ready")
+    except Exception as e:
+        _warm_up_error = str(e)
+        logger.error(f"Error initialising Firestore: {e}")
+
+
+class LazyClient:
+    """Stands in for a Firestore client and resolves it on first attribute access."""
+
+    def __init__(self, resolve=get_db):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import logging
+import os
+
+from flask import current_app, jsonify, request
+
+from order_cache import TTLCache
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class Idempotent:
+    """Route decorator that deduplicates calls for the same order.
+
+    Calls are keyed by route, order_id and customer_email. While one call is
+    running, duplicates wait for it and get its response; successful
+    responses are then replayed for `ttl` seconds. Pass a shared backend
+    (e.g. order_cache.SQLiteCacheBackend) to replay across worker processes.
+    The ASGI app goes through `run_async` instead of decorating its views.
+    """
+
+    def __init__(self, ttl=30, maxsize=10000, wait_timeout=30, shared=None):
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.results = TTLCache(maxsize)
+        self.shared = shared
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+
+    @classmethod
+    def from_env(cls, shared=None):
+        return cls(ttl=float(os.getenv('IDEMPOTENCY_TTL', '30')), shared=shared)
+
+    def __call__(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            # Anything but a JSON object has no order to key on; the view rejects it
+            order_id = data.get('order_id') if isinstance(data, dict) else None
+            if not order_id:
+                return view(*args, **kwargs)
+
+            key = f"{view.__name__}:{order_id}:{data.get('customer_email')}"
+            result = self._lookup(key)
+            if result is None:
+                try:
+                    result = self._flight.do(key, lambda: self._run(key, view, args, kwargs),
+                                             timeout=self.wait_timeout)
+                except TimeoutError:
+                    logger.warning(f"Timed out waiting for in-flight {view.__name__} for order {order_id}")
+                    retry_after = max(1, int(self.wait_timeout // 10))
+                    return (jsonify({'error': 'This order is still being processed, please retry',
+                                     'retry_after': retry_after}),
+                            503, {'Retry-After': str(retry_after)})
+            else:
+                logger.info(f"Replaying {view.__name__} response for order {order_id}")
+            body, status = result
+            return jsonify(body), status
+
+        return wrapper
+
+    async def run_async(self, name, data, handler):
+        """Runs `await handler(data)` -> (body, status) once per order, like the decorator."""
+        order_id = data.get('order_id') if isinstance(data, dict) else None
+        if not order_id:
+            return await handler(data)
+
+        key = f"{name}:{order_id}:{data.get('customer_email')}"
+        result = await asyncio.to_thread(self._lookup, key)
+        if result is not None:
+            logger.info(f"Replaying {name} response for order {order_id}")
+            return result
+
+        async def run():
+            result = await handler(data)
+            await asyncio.to_thread(self._store, key, result)
+            return result
+
+        return await self._async_flight.do(key, run)
+
+    def _lookup(self, key):
+        result = self.results.get(key)
+        if result is None and self.shared is not None:
+            try:
+                result = self.shared.get(key)
+            except Exception as e:
+                logger.error(f"Error reading shared idempotency cache: {e}")
+        return tuple(result) if result is not None else None
+
+    def _run(self, key, view, args, kwargs):
+        response = current_app.make_response(view(*args, **kwargs))
+        result = (response.get_json(), response.status_code)
+        self._store(key, result)
+        return result
+
+    def _store(self, key, result):
+        if result[1] != 200:
+            return
+        self.results.set(key, result, self.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, result, self.ttl)
+            except Exception as e:
+                logger.error(f"Error writing shared idempotency cache: {e}")
@@ -0,0 +1,165 @@
+"""Structured, non-blocking logging.
+
+Request threads only put records on an in-memory queue; a QueueListener
+thread formats them as one JSON object per line, redacts secrets and PII and
+writes them out. Configured from the environment:
+
+    LOG_LEVEL=INFO                        root level
+    LOG_LEVELS=urllib3=WARNING,app=DEBUG  per-logger overrides
+    LOG_FORMAT=json|text
+    LOG_PAYLOAD_SAMPLE_RATE=0.01          share of payload dumps kept
+    LOG_PAYLOAD_SAMPLE_RATES=webhook=0.1  per-route overrides
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+
+REDACTED = '[REDACTED]'
+
+SECRET_KEYS = {
+    'x-client-secret', 'x-client-id', 'client_secret', 'secret_key', 'authorization',
+    'private_key', 'private_key_id', 'firebase_key_base64', 'x-webhook-signature',
+    'payment_session_id',
+}
+PII_KEYS = {
+    'customer_email', 'customer_phone', 'customer_name', 'email', 'phone', 'name',
+    'upi_id', 'bank_reference', 'auth_id', 'card_number',
+}
+REDACT_KEYS = SECRET_KEYS | PII_KEYS
+
+# Catches "'key': 'value'" pairs in dict reprs and key=value pairs in text,
+# plus anything shaped like a Cashfree secret key
+_KEY_PATTERN = '|'.join(re.escape(key) for key in sorted(REDACT_KEYS, key=len, reverse=True))
+_PAIR_RE = re.compile(rf"""(['"]?\b(?:{_KEY_PATTERN})['"]?\s*[:=]\s*)(['"])(.*?)\2|(\b(?:{_KEY_PATTERN})=)([^\s,]+)""",
+                      re.IGNORECASE)
+_SECRET_RE = re.compile(r'cfsk_[A-Za-z0-9_]+')
+# Emails show up in free text too ("No user found with email ...")
+_EMAIL_RE = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}')
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_default_sample_rate = 0.0
+_sample_rates = {}
+
+
+def redact(value):
+    """Returns a copy of value with secret and PII fields masked."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in REDACT_KEYS and v is not None else redact(v)
+                for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+def redact_text(text):
+    def replace(match):
+        if match.group(1):
+            return f'{match.group(1)}{match.group(2)}{REDACTED}{match.group(2)}'
+        return f'{match.group(4)}{REDACTED}'
+    text = _SECRET_RE.sub(REDACTED, _PAIR_RE.sub(replace, text))
+    return _EMAIL_RE.sub(REDACTED, text)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': redact_text(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                event[key] = redact(value)
+        if record.exc_info:
+            event['exc'] = redact_text(self.formatException(record.exc_info))
+        return json.dumps(event, default=str)
+
+
+class RedactingTextFormatter(logging.Formatter):
+    def format(self, record):
+        return redact_text(super().format(record))
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging():
+    """Installs the queue-based handler on the root logger. Safe to call twice."""
+    global _listener, _default_sample_rate, _sample_rates
+    if _listener is not None:
+        return
+
+    _default_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+    _sample_rates = {route: float(rate) for route, rate in _parse_pairs(os.getenv('LOG_PAYLOAD_SAMPLE_RATES', '')).items()}
+
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = RedactingTextFormatter('%(levelname)s:%(name)s:%(message)s')
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    # urllib3 logs every connection at DEBUG; keep it quiet unless asked for
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    for name, level in _parse_pairs(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in value.split(','):
+        if '=' in item:
+            key, val = item.split('=', 1)
+            pairs[key.strip()] = val.strip()
+    return pairs
+
+
+def log_payload(logger, route, message, payload, **fields):
+    """Logs a payload dump at DEBUG for a sampled share of calls on `route`.
+
+    The payload is passed through untouched and only serialised (and redacted)
+    by the listener thread, so skipped or sampled-out calls cost nothing.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= _sample_rates.get(route, _default_sample_rate):
+        return
+    logger.debug(message, extra={'route': route, 'payload': payload, **fields})
+
+
+def log_request(logger, route, status, started, **fields):
+    """One access-log event per request, with its latency."""
+    logger.info('request', extra={
+        'route': route,
+        'status': status,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        **fields,
+    })
@@ -0,0 +1,145 @@
+"""Low-overhead latency instrumentation.
+
+`span()` times a block, feeds a per-dependency histogram and remembers the
+timing for the current request so it can be returned in a Server-Timing
+header. `render()` produces the Prometheus text exposition for /metrics.
+Metrics are per process; each gunicorn worker reports its own.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Seconds; tuned for calls that take between a few ms and the read timeout
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 1024
+
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for quantiles."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                    'recent': deque(maxlen=RESERVOIR_SIZE),
+                }
+            index = bisect.bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+            series['recent'].append(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        quantile_lines = [f'# HELP {self.name}_recent {self.help_text} '
+                          f'(quantiles over the last {RESERVOIR_SIZE} samples)',
+                          f'# TYPE {self.name}_recent gauge']
+        with self._lock:
+            snapshot = [(labels, list(s['buckets']), s['count'], s['sum'], sorted(s['recent']))
+                        for labels, s in sorted(self._series.items())]
+
+        for labels, buckets, count, total, recent in snapshot:
+            base = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {count}')
+            for q in QUANTILES:
+                value = recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0
+                quantile_lines.append(f'{self.name}_recent{{{base},quantile="{q}"}} {value:.6f}')
+        return lines + quantile_lines
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests by route.', ('route', 'status'))
+dependency_duration = Histogram(
+    'dependency_duration_seconds', 'Time spent in outbound calls by dependency and operation.',
+    ('dependency', 'operation'))
+
+# Other modules register callables returning extra exposition lines
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def start_request():
+    _request_spans.set([])
+
+
+@contextmanager
+def span(dependency, operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(dependency, operation, time.perf_counter() - start)
+
+
+def record(dependency, operation, seconds):
+    dependency_duration.observe((dependency, operation), seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((f'{dependency}.{operation}', seconds))
+
+
+def finish_request(route, status, seconds, queue_seconds=None):
+    """Records the request and returns its Server-Timing header value."""
+    request_duration.observe((route, str(status)), seconds)
+    spans = _request_spans.get() or []
+    _request_spans.set(None)
+    entries = [f'{name};dur={duration * 1000:.1f}' for name, duration in spans]
+    if queue_seconds is not None:
+        dependency_duration.observe(('worker', 'queue'), queue_seconds)
+        entries.append(f'queue;dur={queue_seconds * 1000:.1f}')
+    entries.append(f'total;dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def queue_time(request_start_header, now=None):
+    """Parses X-Request-Start ("t=<epoch>" in s, ms or us) into seconds spent queued."""
+    if not request_start_header:
+        return None
+    try:
+        value = float(request_start_header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    # Normalise microseconds / milliseconds to seconds
+    while value > 1e11:
+        value /= 1000
+    return max(0.0, (now or time.time()) - value)
+
+
+def render():
+    lines = request_duration.render() + dependency_duration.render()
+    for collector in _collectors:
+        lines.extend(collector())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_ORDER_STATUSES = ('PAID', 'EXPIRED', 'TERMINATED')
+
+
+class TTLCache:
+    """Bounded in-process LRU cache with a per-entry expiry."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    """Cache shared by every worker process on the host through a SQLite file.
+
+    Every `purge_every` writes, expired rows are deleted and the entries
+    closest to expiry are evicted until at most `max_rows` remain.
+    """
+
+    def __init__(self, path, max_rows=100000, purge_every=1000):
+        self.path = path
+        self.max_rows = max_rows
+        self.purge_every = purge_every
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS order_cache '
+                     '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS order_cache_expires_at ON order_cache (expires_at)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT value FROM order_cache WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        self._conn().execute('INSERT OR REPLACE INTO order_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                             (key, json.dumps(value), time.time() + ttl))
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes >= self.purge_every
+            if due:
+                self._writes = 0
+        if due:
+            try:
+                self.purge_expired()
+            except sqlite3.Error as e:
+                logger.error(f"Error purging shared cache: {e}")
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM order_cache WHERE key = ?', (key,))
+
+    def purge_expired(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM order_cache WHERE expires_at <= ?', (time.time(),))
+        excess = conn.execute('SELECT COUNT(*) FROM order_cache').fetchone()[0] - self.max_rows
+        if excess > 0:
+            conn.execute('DELETE FROM order_cache WHERE key IN '
+                         '(SELECT key FROM order_cache ORDER BY expires_at LIMIT ?)', (excess,))
+
+
+def shared_cache_from_env():
+    """The host-wide cache at ORDER_CACHE_PATH, or None when it isn't set."""
+    path = os.getenv('ORDER_CACHE_PATH')
+    if not path:
+        return None
+    return SQLiteCacheBackend(path, max_rows=int(os.getenv('ORDER_CACHE_SHARED_MAX_ROWS', '100000')))
+
+
+class OrderStatusCache:
+    """Caches Cashfree order lookups as (status_code, data) pairs.
+
+    Terminal orders are kept for terminal_ttl, everything else only for
+    pending_ttl. Concurrent misses for one order share a single upstream
+    call, and webhook events fill or invalidate entries as they arrive.
+    """
+
+    def __init__(self, fetch, maxsize=10000, terminal_ttl=3600, pending_ttl=3, shared=None):
+        self.fetch = fetch
+        self.terminal_ttl = terminal_ttl
+        self.pending_ttl = pending_ttl
+        self.local = TTLCache(maxsize)
+        self.shared = shared
+        self._flight = SingleFlight()
+
+    @classmethod
+    def from_env(cls, fetch, shared=None):
+        return cls(
+            fetch,
+            maxsize=int(os.getenv('ORDER_CACHE_SIZE', '10000')),
+            terminal_ttl=float(os.getenv('ORDER_CACHE_TERMINAL_TTL', '3600')),
+            pending_ttl=float(os.getenv('ORDER_CACHE_PENDING_TTL', '3')),
+            shared=shared,
+        )
+
+    def get(self, order_id):
+        cached = self.local.get(order_id)
+        if cached is not None:
+            return cached
+        return self._flight.do(order_id, lambda: self._load(order_id))
+
+    def _load(self, order_id):
+        cached = self._shared_get(order_id)
+        if cached is not None:
+            return cached
+        return self._store_response(order_id, self.fetch(order_id))
+
+    def _shared_get(self, order_id):
+        if self.shared is None:
+            return None
+        try:
+            cached = self.shared.get(order_id)
+        except Exception as e:
+            logger.error(f"Error reading shared order cache: {e}")
+            return None
+        if cached is not None:
+            cached = tuple(cached)
+            self._store_local(order_id, cached)
+        return cached
+
+    def _store_response(self, order_id, response):
+        result = (response.status_code, response.json())
+        # Only successful lookups are cached; errors go upstream again next time
+        if response.status_code == 200:
+            self.put(order_id, result[1])
+        return result
+
+    def _ttl(self, data):
+        return self.terminal_ttl if data.get('order_status') in TERMINAL_ORDER_STATUSES else self.pending_ttl
+
+    def _store_local(self, order_id, result):
+        self.local.set(order_id, result, self._ttl(result[1]))
+
+    def put(self, order_id, data):
+        result = (200, data)
+        self._store_local(order_id, result)
+        if self.shared is not None:
+            try:
+                self.shared.set(order_id, result, self._ttl(data))
+            except Exception as e:
+                logger.error(f"Error writing shared order cache: {e}")
+
+    def invalidate(self, order_id):
+        self.local.delete(order_id)
+        if self.shared is not None:
+            try:
+                self.shared.delete(order_id)
+            except Exception as e:
+                logger.error(f"Error invalidating shared order cache: {e}")
+
+    def record_payment(self, order_id, payment_status, customer_details=None):
+        """Applies a payment event: a success marks the order PAID, anything else drops the entry."""
+        if payment_status == 'SUCCESS':
+            self.put(order_id, {
+                'order_id': order_id,
+                'order_status': 'PAID',
+                'customer_details': customer_details or {},
+            })
+        else:
+            self.invalidate(order_id)
+
+
+class AsyncOrderStatusCache(OrderStatusCache):
+    """OrderStatusCache for the ASGI app; `fetch` and `get` are coroutines.
+
+    The shared backend is only touched from worker threads so SQLite never
+    blocks the event loop.
+    """
+
+    def __init__(self, fetch, maxsize=10000, terminal_ttl=3600, pending_ttl=3, shared=None):
+        super().__init__(fetch, maxsize, terminal_ttl, pending_ttl, shared)
+        self._flight = AsyncSingleFlight()
+
+    async def get(self, order_id):
+        cached = self.local.get(order_id)
+        if cached is not None:
+            return cached
+        return await self._flight.do(order_id, lambda: self._load(order_id))
+
+    async def _load(self, order_id):
+        if self.shared is not None:
+            cached = await asyncio.to_thread(self._shared_get, order_id)
+            if cached is not None:
+                return cached
+        response = await self.fetch(order_id)
+        if self.shared is None:
+            return self._store_response(order_id, response)
+        return await asyncio.to_thread(self._store_response, order_id, response)
@@ -0,0 +1,152 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# orders/{order_id} holds one compact record per order and is the primary
+# lookup. The `orders` map on users/{email} is still written for the
+# frontend but is only read for orders that predate the index.
+INDEX_COLLECTION = 'orders'
+INDEX_FIELDS = ('order_amount', 'payment_session_id', 'payment_status', 'original_order_id')
+
+# Firestore allows 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+def index_record(order_details, customer_email, customer_name=None):
+    record = {field: order_details.get(field) for field in INDEX_FIELDS if order_details.get(field) is not None}
+    record['customer_email'] = customer_email
+    if customer_name:
+        record['customer_name'] = customer_name
+    return record
+
+
+def get_order_record(db, order_id, customer_email):
+    """Returns the indexed record for an order owned by customer_email, or None.
+
+    Orders missing from the index are looked up on the user document and
+    backfilled so the next lookup is a single small read.
+    """
+    steps = _order_record_lookup(db, order_id, customer_email)
+    try:
+        ref = next(steps)
+        while True:
+            ref = steps.send(ref.get())
+    except StopIteration as done:
+        record, backfill = done.value
+    if backfill:
+        try:
+            db.collection(INDEX_COLLECTION).document(order_id).set(record, merge=True)
+        except Exception as e:
+            logger.error(f"Error backfilling order index for {order_id}: {e}")
+    return record
+
+
+async def get_order_record_async(db, order_id, customer_email):
+    """get_order_record for Firestore's AsyncClient."""
+    steps = _order_record_lookup(db, order_id, customer_email)
+    try:
+        ref = next(steps)
+        while True:
+            ref = steps.send(await ref.get())
+    except StopIteration as done:
+        record, backfill = done.value
+    if backfill:
+        try:
+            await db.collection(INDEX_COLLECTION).document(order_id).set(record, merge=True)
+        except Exception as e:
+            logger.error(f"Error backfilling order index for {order_id}: {e}")
+    return record
+
+
+def _order_record_lookup(db, order_id, customer_email):
+    """The lookup shared by both readers.
+
+    Yields the document references to read and is sent back their
+    snapshots; returns (record, whether to backfill the index).
+    """
+    order_doc = yield db.collection(INDEX_COLLECTION).document(order_id)
+    if order_doc.exists:
+        record = order_doc.to_dict()
+        owner = record.get('customer_email')
+        if owner and owner != customer_email:
+            return None, False
+        if owner and record.get('order_amount') is not None:
+            return record, False
+
+    user_doc = yield db.collection('users').document(customer_email)
+    if not user_doc.exists:
+        return None, False
+    user_data = user_doc.to_dict()
+    order_details = user_data.get('orders', {}).get(order_id)
+    if order_details is None:
+        return None, False
+    return index_record(order_details, customer_email, user_data.get('name')), True
+
+
+def migrate_user_orders(db, page_size=100, checkpoint_path=None, batch_size=400, dry_run=False, echo=print):
+    """Backfills the order index from the `orders` map of every user document.
+
+    Users are read page by page in document-id order and the last completed
+    user id is written to checkpoint_path after each page, so an interrupted
+    run picks up where it stopped. Returns (users, orders) processed.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    batch_size = min(batch_size, MAX_BATCH_WRITES)
+    last_user_id = read_checkpoint(checkpoint_path)
+    if last_user_id:
+        echo(f"Resuming after user {last_user_id}")
+
+    users_seen = orders_seen = 0
+    while True:
+        query = db.collection('users').order_by(FieldPath.document_id()).limit(page_size)
+        if last_user_id:
+            query = query.start_after({FieldPath.document_id(): last_user_id})
+        page = list(query.stream())
+        if not page:
+            break
+
+        batch, pending = db.batch(), 0
+        for user_doc in page:
+            user_data = user_doc.to_dict() or {}
+            for order_id, order_details in (user_data.get('orders') or {}).items():
+                if not isinstance(order_details, dict):
+                    continue
+                record = index_record(order_details, user_doc.id, user_data.get('name'))
+                batch.set(db.collection(INDEX_COLLECTION).document(order_id), record, merge=True)
+                pending += 1
+                orders_seen += 1
+                if pending >= batch_size:
+                    if not dry_run:
+                        batch.commit()
+                    batch, pending = db.batch(), 0
+        if pending and not dry_run:
+            batch.commit()
+
+        users_seen += len(page)
+        last_user_id = page[-1].id
+        if not dry_run:
+            write_checkpoint(checkpoint_path, last_user_id)
+        echo(f"Indexed {orders_seen} orders from {users_seen} users (last user {last_user_id})")
+
+        if len(page) < page_size:
+            break
+
+    return users_seen, orders_seen
+
+
+def read_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return f.read().strip() or None
+    return None
+
+
+def write_checkpoint(path, value):
+    if not path:
+        return
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(value)
+    os.replace(tmp_path, path)
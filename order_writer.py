@@ -0,0 +1,224 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from webhook_queue import order_status_rank
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows 500 writes per batch and every status update touches two
+# documents (orders/{order_id} and users/{email}).
+MAX_WRITES_PER_BATCH = 500
+
+
+class OrderStatusWriter:
+    """Coalesces payment status updates into Firestore WriteBatch commits.
+
+    Each batch reads the orders/{order_id} index records and then their
+    owners' user documents, one get_all call each, and writes the status to
+    the index and to the indexed owner's orders map, never to the caller's
+    email. The map is only written when it already holds the order, so no
+    partial entries are created. An update whose caller email doesn't match
+    the owner is rejected, and so is one that would move the order back to
+    a lower-ranked status (webhook_queue.STATUS_RANK). Orders that only live
+    on a user document go through the legacy read-and-check path, and a
+    batch that fails with NotFound is replayed one order at a time.
+
+    `submit` returns a Future resolving to True once the update was applied
+    (or definitively rejected) and False when it failed and should be retried.
+    """
+
+    def __init__(self, db, max_batch_size=200, max_delay=0.05):
+        self.db = db
+        self.max_batch_size = min(max_batch_size, MAX_WRITES_PER_BATCH // 2)
+        self.max_delay = max_delay
+        self._pending = {}
+        self._first_pending_at = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='order-status-writer', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(
+            db,
+            max_batch_size=int(os.getenv('STATUS_BATCH_SIZE', '200')),
+            max_delay=float(os.getenv('STATUS_BATCH_DELAY', '0.05')),
+        )
+
+    def submit(self, order_id, status, customer_email=None):
+        future = Future()
+        with self._cond:
+            # A newer status from the same caller replaces the queued one and
+            # both are resolved by the write that wins. Callers with different
+            # emails stay separate so one can't get the other's rejected.
+            key = (order_id, customer_email)
+            previous = self._pending.get(key)
+            futures = previous[1] + [future] if previous else [future]
+            self._pending[key] = (status, futures)
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            self._cond.notify()
+        return future
+
+    def update(self, order_id, status, customer_email=None, timeout=10):
+        return self.submit(order_id, status, customer_email).result(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Flush on size or once the oldest queued update is max_delay old
+                while len(self._pending) < self.max_batch_size:
+                    remaining = self._first_pending_at + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending, self._pending = self._pending, {}
+                self._first_pending_at = None
+
+            try:
+                self._flush(pending)
+            except Exception as e:
+                logger.error(f"Error flushing order status batch: {e}")
+                for _, futures in pending.values():
+                    _resolve(futures, False)
+
+    def _flush(self, pending):
+        from google.api_core.exceptions import NotFound
+
+        ops = sorted(((order_id, status, email, futures)
+                      for (order_id, email), (status, futures) in pending.items()),
+                     key=lambda op: (op[2] or '', op[0]))
+        for start in range(0, len(ops), self.max_batch_size):
+            chunk = ops[start:start + self.max_batch_size]
+            try:
+                with metrics.span('firestore', 'get_owners'):
+                    records = self._read('orders', {order_id for order_id, *_ in chunk})
+                    owners = {record.get('customer_email') for record in records.values()}
+                    user_orders = {email: user.get('orders') or {}
+                                   for email, user in self._read('users', owners - {None}).items()}
+            except Exception as e:
+                logger.error(f"Error reading order index: {e}")
+                for *_, futures in chunk:
+                    _resolve(futures, False)
+                continue
+
+            batch, batched = self.db.batch(), []
+            current = {order_id: record.get('payment_status') for order_id, record in records.items()}
+            for order_id, status, email, futures in chunk:
+                record = records.get(order_id)
+                if record is None:
+                    # Only on a user document, if anywhere
+                    _resolve(futures, self._update_user_order(order_id, status, email) if email else True)
+                    continue
+                owner = record.get('customer_email')
+                if not _owned_by(owner, email) or _is_stale(order_id, current[order_id], status):
+                    _resolve(futures, True)
+                    continue
+                current[order_id] = status
+                if owner and order_id not in user_orders.get(owner, {}):
+                    logger.error(f"No matching order found for {order_id} under email {owner}")
+                    owner = None
+                self._add_writes(batch, order_id, status, owner)
+                batched.append((order_id, status, email, futures))
+            if not batched:
+                continue
+
+            try:
+                with metrics.span('firestore', 'batch_commit'):
+                    batch.commit()
+            except NotFound:
+                # One missing document fails the whole batch; isolate it
+                for order_id, status, email, futures in batched:
+                    _resolve(futures, self._apply_single(order_id, status, email))
+                continue
+            except Exception as e:
+                logger.error(f"Error committing order status batch: {e}")
+                for *_, futures in batched:
+                    _resolve(futures, False)
+                continue
+            for order_id, status, _, futures in batched:
+                logger.info(f"Order {order_id} updated with payment status: {status}")
+                _resolve(futures, True)
+
+    def _read(self, collection, doc_ids):
+        refs = [self.db.collection(collection).document(doc_id) for doc_id in doc_ids]
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def _add_writes(self, batch, order_id, status, owner):
+        batch.update(self.db.collection('orders').document(order_id), {'payment_status': status})
+        if owner:
+            batch.update(self.db.collection('users').document(owner), {
+                f'orders.{order_id}.payment_status': status
+            })
+
+    def _apply_single(self, order_id, status, email):
+        try:
+            order_ref = self.db.collection('orders').document(order_id)
+            order_doc = order_ref.get()
+            if not order_doc.exists:
+                return self._update_user_order(order_id, status, email) if email else True
+            record = order_doc.to_dict()
+            owner = record.get('customer_email')
+            if not _owned_by(owner, email) or _is_stale(order_id, record.get('payment_status'), status):
+                return True
+            order_ref.update({'payment_status': status})
+        except Exception as e:
+            logger.error(f"Error updating order status: {e}")
+            return False
+        if not owner:
+            logger.info(f"Order {order_id} updated with payment status: {status}")
+            return True
+        # The owner's user document may be missing; this checks before writing
+        return self._update_user_order(order_id, status, owner)
+
+    def _update_user_order(self, order_id, status, email):
+        try:
+            user_ref = self.db.collection('users').document(email)
+            user_doc = user_ref.get()
+
+            if user_doc.exists:
+                orders = user_doc.to_dict().get('orders', {})
+
+                if order_id in orders:
+                    if _is_stale(order_id, (orders[order_id] or {}).get('payment_status'), status):
+                        return True
+                    user_ref.update({
+                        f'orders.{order_id}.payment_status': status
+                    })
+                    logger.info(f"Order {order_id} updated with payment status: {status}")
+                else:
+                    logger.error(f"No matching order found for {order_id} under email {email}")
+            else:
+                logger.error(f"No user found with email {email}")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating order status: {e}")
+            return False
+
+
+def _owned_by(owner, email):
+    """False (and logged) when the caller's email names someone other than the indexed owner."""
+    if email and owner and owner.strip().lower() != email.strip().lower():
+        logger.error(f"Order belongs to {owner}, not {email}; status update rejected")
+        return False
+    return True
+
+
+def _is_stale(order_id, current, status):
+    """True (and logged) when `status` ranks below the order's current status."""
+    if order_status_rank(status) < order_status_rank(current):
+        logger.info(f"Order {order_id} is already {current}; ignoring stale status {status}")
+        return True
+    return False
+
+
+def _resolve(futures, result):
+    for future in futures:
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,172 @@
+"""Reconciliation of orders stuck in `pending`.
+
+Orders normally leave `pending` through a webhook or the redirect to
+/payment_response. When both are missed the order is stuck, so this streams
+pending orders from the order index a page at a time, asks Cashfree for each
+one's state through a bounded, rate-limited worker pool and writes corrected
+statuses back through the batched OrderStatusWriter. Progress is
+checkpointed after every page so an interrupted run resumes where it left off.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from circuit_breaker import UpstreamUnavailable
+from order_index import INDEX_COLLECTION, read_checkpoint, write_checkpoint
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Cashfree order_status -> our payment_status; ACTIVE orders stay pending
+CASHFREE_ORDER_STATUSES = {
+    'PAID': 'Order Completed',
+    'EXPIRED': 'Expired',
+    'TERMINATED': 'Terminated',
+}
+
+
+class Reconciler:
+    def __init__(self, db, cashfree, status_writer, workers=8, rate=5.0, page_size=200, on_order=None):
+        self.db = db
+        self.cashfree = cashfree
+        self.status_writer = status_writer
+        self.workers = workers
+        self.page_size = page_size
+        # A rate of 0 (or less) means no limit, as with CASHFREE_RATE_LIMIT
+        self.rate = rate
+        self.limiter = TokenBucket(rate, burst=max(1, workers)) if rate > 0 else None
+        # Called with (order_id, cashfree_order) for every successful lookup
+        self.on_order = on_order
+
+    def run(self, checkpoint_path=None, max_orders=None, stop_event=None, echo=logger.info):
+        """Reconciles pending orders and returns counts of what happened.
+
+        The checkpoint is removed once a pass reaches the end, so the next
+        pass starts from the beginning.
+        """
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        stats = {'checked': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        last_order_id = read_checkpoint(checkpoint_path)
+        if last_order_id:
+            echo(f"Resuming reconciliation after order {last_order_id}")
+
+        finished = False
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reconcile') as pool:
+            while not (stop_event and stop_event.is_set()):
+                query = (self.db.collection(INDEX_COLLECTION)
+                         .where('payment_status', '==', 'pending')
+                         .order_by(FieldPath.document_id())
+                         .limit(self.page_size))
+                if last_order_id:
+                    query = query.start_after({FieldPath.document_id(): last_order_id})
+                page = [(doc.id, doc.to_dict() or {}) for doc in query.stream()]
+                if not page:
+                    finished = True
+                    break
+
+                # Only one page is held in memory and in flight at a time
+                for result in pool.map(self._reconcile_one, page):
+                    stats['checked'] += 1
+                    stats[result] += 1
+
+                last_order_id = page[-1][0]
+                write_checkpoint(checkpoint_path, last_order_id)
+                echo(f"Reconciled up to order {last_order_id}: {stats}")
+
+                if len(page) < self.page_size:
+                    finished = True
+                    break
+                if max_orders and stats['checked'] >= max_orders:
+                    break
+
+        if finished and checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return stats
+
+    def _reconcile_one(self, item):
+        order_id, record = item
+        try:
+            if self.limiter:
+                self.limiter.acquire()
+            response = self._get_order(order_id)
+            if response.status_code != 200:
+                logger.error(f"Cashfree returned {response.status_code} for order {order_id} during reconciliation")
+                return 'failed' if response.status_code >= 500 or response.status_code == 429 else 'unchanged'
+            cashfree_order = response.json()
+        except Exception as e:
+            logger.error(f"Error checking order {order_id} during reconciliation: {e}")
+            return 'failed'
+
+        if self.on_order:
+            self.on_order(order_id, cashfree_order)
+
+        status = CASHFREE_ORDER_STATUSES.get(cashfree_order.get('order_status'))
+        if status is None:
+            return 'unchanged'
+        if not self.status_writer.update(order_id, status, record.get('customer_email'), timeout=30):
+            return 'failed'
+        logger.info(f"Reconciled order {order_id} to {status}")
+        return 'updated'
+
+    def _get_order(self, order_id, attempts=3):
+        # Wait out an open circuit rather than marking the whole page failed
+        for attempt in range(attempts):
+            try:
+                return self.cashfree.get_order(order_id)
+            except UpstreamUnavailable as e:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(e.retry_after)
+
+
+def acquire_lock(lock_path):
+    """Takes the per-host reconciliation lock without waiting.
+
+    Returns the open lock file (close it to release the lock), or None if
+    another process holds it.
+    """
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class ReconcileJob:
+    """Runs a reconciliation pass every `interval` seconds on a daemon thread.
+
+    A lock file makes sure only one worker process per host runs the job.
+    """
+
+    def __init__(self, reconciler, interval, checkpoint_path, lock_path):
+        self.reconciler = reconciler
+        self.interval = interval
+        self.checkpoint_path = checkpoint_path
+        self.lock_path = lock_path
+        self._stop = threading.Event()
+        self._lock_file = None
+
+    def start(self):
+        self._lock_file = acquire_lock(self.lock_path)
+        if self._lock_file is None:
+            logger.info("Reconciliation job already running in another worker")
+            return False
+        threading.Thread(target=self._run, name='reconcile-job', daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stats = self.reconciler.run(self.checkpoint_path, stop_event=self._stop)
+                logger.info(f"Reconciliation pass finished: {stats}")
+            except Exception as e:
+                logger.error(f"Error during reconciliation pass: {e}")
@@ -0,0 +1,202 @@
+"""Cheap checks that run on /webhook before a delivery is queued.
+
+Signatures are verified over the raw body before it is parsed, and
+deliveries that would not change anything (retries, the extra event types
+Cashfree sends per payment, or statuses that would move an order backwards)
+are dropped before they reach Firestore. WebhookIntake puts it together
+for /webhook in both app.py and asgi_app.py.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from log_config import log_payload
+from order_cache import TTLCache
+from webhook_queue import STATUS_RANK, parse_webhook, webhook_field
+
+logger = logging.getLogger(__name__)
+
+# Event types that carry a payment status; anything else is acknowledged and dropped
+PAYMENT_WEBHOOK_TYPES = {
+    'PAYMENT_SUCCESS_WEBHOOK',
+    'PAYMENT_FAILED_WEBHOOK',
+    'PAYMENT_USER_DROPPED_WEBHOOK',
+    'PAYMENT_CHARGES_WEBHOOK',
+}
+
+WEBHOOK_OUTCOMES = ('queued', 'duplicate', 'stale', 'ignored', 'rejected')
+
+
+def cf_payment_id(data):
+    return webhook_field(data, 'payment', 'cf_payment_id')
+
+
+def verify_signature(raw_body, timestamp, signature, secret, max_age=0):
+    """Checks Cashfree's x-webhook-signature: base64(HMAC-SHA256(timestamp + body)).
+
+    With max_age set, deliveries whose x-webhook-timestamp (epoch ms) is
+    older than that many seconds are rejected as replays.
+    """
+    if not (timestamp and signature and secret):
+        return False
+    if max_age:
+        try:
+            if time.time() - int(timestamp) / 1000 > max_age:
+                return False
+        except ValueError:
+            return False
+    digest = hmac.new(secret.encode(), timestamp.encode() + raw_body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+class WebhookDeduplicator:
+    """Bounded, time-expiring memory of webhook deliveries already queued.
+
+    Pass a shared backend (e.g. order_cache.SQLiteCacheBackend) to share it
+    between the workers on a host.
+    """
+
+    def __init__(self, maxsize=50000, ttl=86400, shared=None):
+        self.ttl = ttl
+        self.seen = TTLCache(maxsize)
+        self.last_status = TTLCache(maxsize)
+        self.shared = shared
+
+    def should_skip(self, order_id, cf_payment_id, payment_status):
+        """Returns a reason to drop the delivery, or None if it should be applied."""
+        if self._get(self.seen, f'webhook-seen:{order_id}:{cf_payment_id}:{payment_status}') is not None:
+            return 'duplicate'
+        last = self._get(self.last_status, f'webhook-status:{order_id}')
+        if last is not None and STATUS_RANK.get(payment_status, 0) < STATUS_RANK.get(last, 0):
+            return 'stale'
+        return None
+
+    def record(self, order_id, cf_payment_id, payment_status):
+        self._set(self.seen, f'webhook-seen:{order_id}:{cf_payment_id}:{payment_status}', True)
+        last = self._get(self.last_status, f'webhook-status:{order_id}')
+        if last is None or STATUS_RANK.get(payment_status, 0) >= STATUS_RANK.get(last, 0):
+            self._set(self.last_status, f'webhook-status:{order_id}', payment_status)
+
+    def _get(self, cache, key):
+        value = cache.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.error(f"Error reading shared webhook dedup cache: {e}")
+            if value is not None:
+                cache.set(key, value, self.ttl)
+        return value
+
+    def _set(self, cache, key, value):
+        cache.set(key, value, self.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                logger.error(f"Error writing shared webhook dedup cache: {e}")
+
+
+class WebhookIntake:
+    """Everything /webhook does before the background workers take over.
+
+    `handle` verifies and filters one delivery, updates the order cache and
+    puts the payload on the durable queue. It blocks on SQLite, so the ASGI
+    app calls it from a worker thread.
+    """
+
+    def __init__(self, queue, order_cache, dedup, secret=None, verify=True, max_age=0,
+                 on_queued=None):
+        self.queue = queue
+        self.order_cache = order_cache
+        self.dedup = dedup
+        self.secret = secret
+        self.verify = verify
+        self.max_age = max_age
+        self.on_queued = on_queued
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, queue, order_cache, shared=None, on_queued=None):
+        # Cashfree signs webhooks with the client secret; WEBHOOK_VERIFY_SIGNATURE=0
+        # turns the check off for local testing. WEBHOOK_MAX_AGE_SECONDS rejects
+        # signed deliveries older than that as replays (0 disables the check).
+        dedup = WebhookDeduplicator(
+            maxsize=int(os.getenv('WEBHOOK_DEDUP_SIZE', '50000')),
+            ttl=float(os.getenv('WEBHOOK_DEDUP_TTL', '86400')),
+            shared=shared,
+        )
+        return cls(
+            queue, order_cache, dedup,
+            secret=os.getenv('CASHFREE_SECRET_KEY'),
+            verify=os.getenv('WEBHOOK_VERIFY_SIGNATURE', '1') != '0',
+            max_age=float(os.getenv('WEBHOOK_MAX_AGE_SECONDS', '0')),
+            on_queued=on_queued,
+        )
+
+    def handle(self, raw_body, headers):
+        """Returns the (body, status) to answer the delivery with."""
+        if self.verify and not verify_signature(
+                raw_body, headers.get('x-webhook-timestamp'), headers.get('x-webhook-signature'),
+                self.secret, self.max_age):
+            self._count('rejected')
+            logger.error("Webhook signature verification failed.")
+            return {'status': 'error', 'message': 'Invalid signature'}, 401
+
+        try:
+            data = json.loads(raw_body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return {'status': 'error', 'message': 'Invalid data received'}, 400
+        order_id, payment_status, customer_email = parse_webhook(data)
+        log_payload(logger, 'webhook', "Received webhook data", data, order_id=order_id)
+
+        if data.get('type') and data['type'] not in PAYMENT_WEBHOOK_TYPES:
+            self._count('ignored')
+            return {'status': 'ignored'}, 200
+
+        if not order_id or not payment_status or not customer_email:
+            logger.error("Required data is missing in the webhook.")
+            return {'status': 'error', 'message': 'Invalid data received'}, 400
+
+        payment_id = cf_payment_id(data)
+        skip = self.dedup.should_skip(order_id, payment_id, payment_status)
+        if skip:
+            self._count(skip)
+            return {'status': skip}, 200
+
+        if self.verify:
+            self.order_cache.record_payment(order_id, payment_status, data['data'].get('customer_details'))
+        else:
+            # Unsigned payloads can't be trusted to fill the cache, only to expire it
+            self.order_cache.invalidate(order_id)
+
+        # Persist the event and let the background workers update Firestore
+        self.queue.put(data)
+        if self.on_queued:
+            self.on_queued()
+        self.dedup.record(order_id, payment_id, payment_status)
+        self._count('queued')
+        return {'status': 'success'}, 200
+
+    def metrics_lines(self):
+        """Delivery outcomes for metrics.register_collector."""
+        with self._lock:
+            outcomes = dict(self.outcomes)
+        lines = ['# HELP webhook_deliveries_total Webhook deliveries by what /webhook did with them.',
+                 '# TYPE webhook_deliveries_total counter']
+        for outcome in WEBHOOK_OUTCOMES:
+            lines.append(f'webhook_deliveries_total{{outcome="{outcome}"}} {outcomes.get(outcome, 0)}')
+        return lines
+
+    def _count(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] += 1
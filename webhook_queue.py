@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    leased_until REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS webhook_events_state ON webhook_events (state, id);
+'''
+
+
+def parse_webhook(data):
+    order_id = webhook_field(data, 'order', 'order_id')
+    payment_status = webhook_field(data, 'payment', 'payment_status')
+    customer_email = webhook_field(data, 'customer_details', 'customer_email')
+    return order_id, payment_status, customer_email
+
+
+def webhook_field(data, section, name):
+    """data['data'][section][name], or None if any level is missing or not an object."""
+    payload = data.get('data') if isinstance(data, dict) else None
+    section_data = payload.get(section) if isinstance(payload, dict) else None
+    return section_data.get(name) if isinstance(section_data, dict) else None
+
+
+# How far along a payment status is; neither /webhook nor the status writer
+# moves an order backwards
+STATUS_RANK = {
+    'PENDING': 0,
+    'NOT_ATTEMPTED': 0,
+    'FLAGGED': 1,
+    'USER_DROPPED': 1,
+    'FAILED': 1,
+    'CANCELLED': 1,
+    'VOID': 1,
+    'EXPIRED': 1,
+    'TERMINATED': 1,
+    'SUCCESS': 2,
+}
+
+
+def order_status_for_payment(payment_status):
+    if payment_status == 'SUCCESS':
+        return 'Order Completed'
+    return payment_status.capitalize()
+
+
+def order_status_rank(status):
+    """STATUS_RANK for a stored order payment_status such as 'Order Completed' or 'Failed'."""
+    if not status:
+        return 0
+    payment_status = 'SUCCESS' if status == 'Order Completed' else status.upper()
+    return STATUS_RANK.get(payment_status, 0)
+
+
+def status_update_handler(status_writer, timeout=30):
+    """WebhookWorkerPool handler that applies payment statuses through an OrderStatusWriter."""
+    def apply_webhook_events(events):
+        # Submit the whole batch before waiting so the writer can merge it into
+        # as few Firestore commits as possible
+        submitted = []
+        for event_id, data in events:
+            order_id, payment_status, customer_email = parse_webhook(data)
+            status = order_status_for_payment(payment_status)
+            submitted.append((event_id, status_writer.submit(order_id, status, customer_email)))
+        return [event_id for event_id, future in submitted if future.result(timeout=timeout)]
+
+    return apply_webhook_events
+
+
+class WebhookQueue:
+    """Durable on-disk queue of webhook payloads backed by SQLite in WAL mode.
+
+    Events are leased rather than removed when claimed, so anything a worker
+    was processing when the process died is handed out again once its lease
+    runs out. Failed events are retried with exponential backoff and parked
+    as dead after max_attempts; requeue_dead puts them back. The file can be
+    shared by every gunicorn worker on the host.
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=10, retry_base=2.0, retry_max=600.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.db'),
+            lease_seconds=float(os.getenv('WEBHOOK_QUEUE_LEASE_SECONDS', '60')),
+            max_attempts=int(os.getenv('WEBHOOK_QUEUE_MAX_ATTEMPTS', '10')),
+            retry_base=float(os.getenv('WEBHOOK_QUEUE_RETRY_BASE_SECONDS', '2')),
+            retry_max=float(os.getenv('WEBHOOK_QUEUE_RETRY_MAX_SECONDS', '600')),
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    def put(self, payload):
+        cur = self._conn().execute(
+            'INSERT INTO webhook_events (payload, created_at) VALUES (?, ?)',
+            (json.dumps(payload), time.time()))
+        return cur.lastrowid
+
+    def claim(self, limit=50):
+        """Lease up to `limit` due (or lease-expired) events, oldest first."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # A ready event's leased_until is when its retry backoff ends
+            rows = conn.execute(
+                "SELECT id, payload FROM webhook_events "
+                "WHERE (state = 'ready' AND (leased_until IS NULL OR leased_until <= ?)) "
+                "OR (state = 'leased' AND leased_until < ?) "
+                "ORDER BY id LIMIT ?", (now, now, limit)).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE webhook_events SET state = 'leased', leased_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def ack(self, ids):
+        if ids:
+            self._conn().executemany('DELETE FROM webhook_events WHERE id = ?', [(i,) for i in ids])
+
+    def nack(self, ids):
+        """Return events to the queue after a backoff, parking them as dead after max_attempts."""
+        if not ids:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                f"SELECT id, attempts FROM webhook_events WHERE id IN ({','.join('?' * len(ids))})",
+                list(ids)).fetchall()
+            conn.executemany(
+                "UPDATE webhook_events SET leased_until = ?, "
+                "state = CASE WHEN attempts >= ? THEN 'dead' ELSE 'ready' END WHERE id = ?",
+                [(now + self.retry_delay(attempts), self.max_attempts, event_id) for event_id, attempts in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def retry_delay(self, attempts):
+        return min(self.retry_max, self.retry_base * 2 ** max(0, attempts - 1))
+
+    def requeue_dead(self, ids=None):
+        """Makes dead events (all of them, or just `ids`) ready again with fresh attempts."""
+        query = "UPDATE webhook_events SET state = 'ready', attempts = 0, leased_until = NULL WHERE state = 'dead'"
+        params = []
+        if ids:
+            query += f" AND id IN ({','.join('?' * len(ids))})"
+            params = list(ids)
+        return self._conn().execute(query, params).rowcount
+
+    def depth(self):
+        counts = {'ready': 0, 'leased': 0, 'dead': 0}
+        rows = self._conn().execute('SELECT state, COUNT(*) FROM webhook_events GROUP BY state')
+        for state, count in rows:
+            counts[state] = count
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM webhook_events WHERE state != 'dead'").fetchone()[0]
+        counts['oldest_age_seconds'] = round(time.time() - oldest, 3) if oldest else 0
+        return counts
+
+    def metrics_lines(self):
+        """Queue depth for metrics.register_collector."""
+        try:
+            depth = self.depth()
+        except Exception:
+            return []
+        lines = ['# HELP webhook_queue_events Webhook events in the durable queue by state.',
+                 '# TYPE webhook_queue_events gauge']
+        for state in ('ready', 'leased', 'dead'):
+            lines.append(f'webhook_queue_events{{state="{state}"}} {depth[state]}')
+        lines.append(f'webhook_queue_oldest_age_seconds {depth["oldest_age_seconds"]}')
+        return lines
+
+
+class WebhookWorkerPool:
+    """Background threads that drain a WebhookQueue in batches.
+
+    `handler` receives a list of (id, payload) and returns the ids that were
+    applied; everything else is nacked and retried later.
+    """
+
+    def __init__(self, queue, handler, workers=2, batch_size=50, poll_interval=1.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @classmethod
+    def from_env(cls, queue, handler):
+        return cls(
+            queue,
+            handler,
+            workers=int(os.getenv('WEBHOOK_WORKERS', '2')),
+            batch_size=int(os.getenv('WEBHOOK_BATCH_SIZE', '50')),
+        )
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                events = self.queue.claim(self.batch_size)
+            except Exception as e:
+                logger.error(f"Error claiming webhook events: {e}")
+                events = []
+
+            if not events:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            ids = [event_id for event_id, _ in events]
+            try:
+                done = set(self.handler(events))
+            except Exception as e:
+                logger.error(f"Error applying webhook batch: {e}")
+                done = set()
+            try:
+                self.queue.ack([i for i in ids if i in done])
+                self.queue.nack([i for i in ids if i not in done])
+            except Exception as e:
+                logger.error(f"Error acknowledging webhook events: {e}")